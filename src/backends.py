@@ -0,0 +1,22 @@
+import os
+
+# torch — исходная модель, onnx — ONNX Runtime через sentence-transformers,
+# int8 — динамическая квантизация линейных слоёв PyTorch
+BACKENDS = ("torch", "onnx", "int8")
+
+
+def backend_from_env(var_name: str, default: str = "torch") -> str:
+    backend = os.getenv(var_name, default).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"{var_name}={backend}: ожидается одно из {', '.join(BACKENDS)}")
+    return backend
+
+
+def load_kwargs(backend: str):
+    return {"backend": "onnx"} if backend == "onnx" else {}
+
+
+def quantize_int8(module):
+    import torch
+    torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return module
@@ -0,0 +1,137 @@
+import argparse
+import statistics
+import sys
+import time
+import numpy as np
+from get_model import Model
+from get_reranker import Reranker
+from get_qdrant_client import QdrantClientSingleton
+from backends import BACKENDS
+from chunking import TokenChunker
+
+# Вопросы из test_results.xlsx — на них сверяется порядок реранкера
+SAMPLE_QUESTIONS = [
+    "Какой шрифт используется при оформлении курсовой работы?",
+    "Какой межстрочный интервал требуется?",
+    "Каковы размеры полей страницы?",
+    "Как нумеруются страницы?",
+    "Как оформляются заголовки?",
+]
+
+
+def load_passages(limit):
+    client = QdrantClientSingleton.get_instance()
+    try:
+        points, _ = client.scroll(
+            collection_name="collection_1",
+            limit=limit,
+            with_payload=True,
+            with_vectors=False
+        )
+    finally:
+        QdrantClientSingleton.close()
+    return [p.payload["text"] for p in points]
+
+
+def timed(fn, repeats):
+    fn()  # прогрев
+    times = []
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return result, statistics.median(times)
+
+
+def bench_embedder(backends, passages, repeats, min_cosine):
+    texts = [f"passage: {p}" for p in passages]
+    reference, reference_time = None, None
+    ok = True
+    print(f"\nЭмбеддер ({len(texts)} текстов)")
+    for backend in backends:
+        model = Model.load(backend)
+        vectors, seconds = timed(
+            lambda: model.encode(texts, batch_size=Model.batch_size, normalize_embeddings=True),
+            repeats
+        )
+        if reference is None:
+            reference, reference_time = vectors, seconds
+        cosine = np.sum(np.asarray(vectors) * np.asarray(reference), axis=1)
+        passed = cosine.min() >= min_cosine
+        ok = ok and passed
+        print(
+            f"  {backend:6} {seconds * 1000 / len(texts):7.2f} мс/текст  "
+            f"x{reference_time / seconds:4.2f}  "
+            f"косинус с torch: мин {cosine.min():.4f}, сред {cosine.mean():.4f}  "
+            f"{'OK' if passed else 'РАСХОЖДЕНИЕ'}"
+        )
+    return ok
+
+
+def bench_reranker(backends, passages, repeats, top_k, min_top_k_overlap):
+    pairs = [(q, p) for q in SAMPLE_QUESTIONS for p in passages]
+    reference, reference_time = None, None
+    ok = True
+    print(f"\nРеранкер ({len(pairs)} пар)")
+    for backend in backends:
+        reranker = Reranker.load(backend)
+        scores, seconds = timed(lambda: np.asarray(reranker.predict(pairs, batch_size=32)), repeats)
+        scores = scores.reshape(len(SAMPLE_QUESTIONS), len(passages))
+        if reference is None:
+            reference, reference_time = scores, seconds
+        overlaps = [
+            len(set(np.argsort(-row)[:top_k]) & set(np.argsort(-ref_row)[:top_k])) / top_k
+            for row, ref_row in zip(scores, reference)
+        ]
+        overlap = statistics.mean(overlaps)
+        passed = overlap >= min_top_k_overlap
+        ok = ok and passed
+        print(
+            f"  {backend:6} {seconds * 1000 / len(pairs):7.2f} мс/пару  "
+            f"x{reference_time / seconds:4.2f}  "
+            f"макс. |Δscore| {np.abs(scores - reference).max():.4f}  "
+            f"совпадение top-{top_k}: {overlap:.2%}  "
+            f"{'OK' if passed else 'РАСХОЖДЕНИЕ'}"
+        )
+    return ok
+
+
+# Индексация эмбеддит id токенов чанка, поиск по кэшу и повторные вызовы —
+# строку «passage: текст»; ключ кэша у обоих путей общий, поэтому векторы
+# должны совпадать
+def bench_token_ids(passages, min_cosine):
+    tokenizer = Model.get_instance().tokenizer
+    chunker = TokenChunker(tokenizer, Model.token_budget("passage"), 0)
+    chunks = [chunk for passage in passages for chunk in chunker.split(passage)]
+    from_ids = Model.encode_token_ids([Model.input_ids(c["token_ids"], "passage") for c in chunks])
+    from_text = Model.encode_batched([f"passage: {c['content']}" for c in chunks])
+    cosine = np.sum(from_ids * from_text, axis=1)
+    passed = cosine.min() >= min_cosine
+    print(f"\nid токенов чанкера против текста ({len(chunks)} чанков, backend {Model.backend}): "
+          f"косинус мин {cosine.min():.4f}, сред {cosine.mean():.4f}  {'OK' if passed else 'РАСХОЖДЕНИЕ'}")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка и замер задержки бэкендов эмбеддера и реранкера")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["onnx", "int8"])
+    parser.add_argument("--samples", type=int, default=200, help="сколько чанков взять из Qdrant")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--min-top-k-overlap", type=float, default=0.8)
+    args = parser.parse_args()
+
+    passages = load_passages(args.samples)
+    if not passages:
+        print("Коллекция пуста — сначала запустите get_document.py")
+        sys.exit(1)
+
+    backends = ["torch"] + [b for b in args.backends if b != "torch"]
+    embedder_ok = bench_embedder(backends, passages, args.repeats, args.min_cosine)
+    reranker_ok = bench_reranker(
+        backends, passages[:30], args.repeats, args.top_k, args.min_top_k_overlap
+    )
+    token_ids_ok = bench_token_ids(passages, args.min_cosine)
+    sys.exit(0 if embedder_ok and reranker_ok and token_ids_ok else 1)
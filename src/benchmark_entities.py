@@ -0,0 +1,55 @@
+import argparse
+import re
+import statistics
+import sys
+import time
+from entity_rules import ENTITY_RULES
+from entity_matcher import extract_entities
+from graph import load_chunks_from_qdrant
+
+
+# Прежняя реализация: re.search по каждому шаблону — эталон для сверки
+def extract_entities_legacy(text: str):
+    text = text.lower()
+    found = []
+    for entity, patterns in ENTITY_RULES.items():
+        for pattern in patterns:
+            if re.search(pattern, text):
+                found.append(entity)
+                break
+    return found
+
+
+def bench(fn, texts, repeats):
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for text in texts:
+            fn(text)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка и замер скорости извлечения сущностей на корпусе")
+    parser.add_argument("--collection", default="collection_1")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    texts = [chunk["text"] for chunk in load_chunks_from_qdrant(args.collection)]
+    if not texts:
+        print("Коллекция пуста — сначала запустите get_document.py")
+        sys.exit(1)
+
+    mismatches = [
+        text for text in texts
+        if set(extract_entities(text)) != set(extract_entities_legacy(text))
+    ]
+    legacy_time = bench(extract_entities_legacy, texts, args.repeats)
+    matcher_time = bench(extract_entities, texts, args.repeats)
+
+    print(f"Чанков: {len(texts)}, расхождений с прежней реализацией: {len(mismatches)}")
+    print(f"  re.search по шаблонам: {legacy_time * 1e6 / len(texts):8.1f} мкс/чанк")
+    print(f"  EntityMatcher:         {matcher_time * 1e6 / len(texts):8.1f} мкс/чанк "
+          f"(x{legacy_time / matcher_time:.2f})")
+    sys.exit(1 if mismatches else 0)
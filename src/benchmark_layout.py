@@ -0,0 +1,108 @@
+import argparse
+import random
+import statistics
+import sys
+import time
+from page_layout import assemble_page
+
+
+# Прежняя сборка страницы: цикл по таблицам для каждой строки и сортировка
+# списка пар по ключу — эталон для сверки
+def assemble_page_legacy(lines, table_bboxes, tables_rows):
+    all_items = []
+    for line in lines:
+        inside = False
+        for tx0, ty0, tx1, ty1 in table_bboxes:
+            if (line['x0'] >= tx0 and line['x1'] <= tx1 and
+                line['top'] >= ty0 and line['bottom'] <= ty1):
+                inside = True
+                break
+        if not inside:
+            all_items.append((line['top'], line['text']))
+    for y0, rows_text in tables_rows:
+        for idx, row_text in enumerate(rows_text):
+            all_items.append((y0 + idx * 0.1, row_text))
+    all_items.sort(key=lambda x: x[0])
+    return '\n'.join(text for _, text in all_items)
+
+
+# Страница A4 в пунктах: таблицы друг под другом, строки текста по всей
+# высоте, часть строк попадает в таблицы
+def synthetic_page(rng, n_lines, n_tables, rows_per_table=8):
+    height = 842.0
+    table_bboxes = []
+    tables_rows = []
+    band = height / max(n_tables, 1)
+    for t in range(n_tables):
+        top = t * band + rng.uniform(0, band * 0.2)
+        bottom = top + band * rng.uniform(0.3, 0.7)
+        table_bboxes.append((50.0, top, 545.0, bottom))
+        tables_rows.append((top, [f"таблица {t} строка {r}" for r in range(rows_per_table)]))
+    lines = []
+    for i in range(n_lines):
+        top = rng.uniform(0, height - 12)
+        x0 = rng.uniform(50, 120)
+        lines.append({"x0": x0, "x1": x0 + rng.uniform(100, 420), "top": top, "bottom": top + 11.0,
+                      "text": f"строка {i}"})
+    return lines, table_bboxes, tables_rows
+
+
+# Строки и таблицы реальных страниц извлекаются один раз, замеряется только сборка
+def pdf_pages(paths, max_pages):
+    import pdfplumber
+    pages = []
+    for path in paths:
+        with pdfplumber.open(path) as pdf:
+            for page in pdf.pages:
+                tables = page.find_tables()
+                if not tables:
+                    continue
+                tables_rows = [
+                    (t.bbox[1], [' '.join(c or '' for c in row).strip() for row in t.extract()])
+                    for t in tables
+                ]
+                pages.append((page.extract_text_lines(), [t.bbox for t in tables], tables_rows))
+                if len(pages) >= max_pages:
+                    return pages
+    return pages
+
+
+def bench(fn, pages, repeats):
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for page in pages:
+            fn(*page)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def report(title, pages, repeats):
+    mismatches = sum(1 for page in pages if assemble_page(*page) != assemble_page_legacy(*page))
+    legacy_time = bench(assemble_page_legacy, pages, repeats)
+    new_time = bench(assemble_page, pages, repeats)
+    print(f"{title}: страниц {len(pages)}, расхождений {mismatches}")
+    print(f"  цикл по таблицам:  {legacy_time * 1e6 / len(pages):9.1f} мкс/стр")
+    print(f"  индекс по top:     {new_time * 1e6 / len(pages):9.1f} мкс/стр (x{legacy_time / new_time:.2f})")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка и замер сборки текста страницы с таблицами")
+    parser.add_argument("pdf", nargs="*", help="PDF с таблицами; без них — только синтетические страницы")
+    parser.add_argument("--max-pages", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    mismatches = 0
+    for n_lines, n_tables in ((40, 1), (60, 3), (120, 8), (300, 20)):
+        pages = [synthetic_page(rng, n_lines, n_tables) for _ in range(50)]
+        mismatches += report(f"Синтетика {n_lines} строк × {n_tables} таблиц", pages, args.repeats)
+    if args.pdf:
+        pages = pdf_pages(args.pdf, args.max_pages)
+        if pages:
+            mismatches += report("PDF", pages, args.repeats)
+        else:
+            print("В PDF нет страниц с таблицами")
+    sys.exit(1 if mismatches else 0)
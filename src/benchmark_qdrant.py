@@ -0,0 +1,160 @@
+import argparse
+import sys
+import time
+import numpy as np
+from qdrant_client.models import PointStruct
+from get_qdrant_client import (
+    QdrantClientSingleton, QDRANT_URL, QDRANT_HNSW_M, QDRANT_HNSW_EF_CONSTRUCT, QDRANT_OVERSAMPLING,
+    collection_config, search_params, ensure_payload_indexes, document_filter
+)
+
+source_collection = "collection_1"
+bench_collection = "benchmark_qdrant"
+
+
+# Векторы и имена документов чанков из рабочей коллекции
+def load_points(client, limit):
+    points, offset = [], None
+    while len(points) < limit:
+        batch, offset = client.scroll(
+            collection_name=source_collection,
+            limit=min(256, limit - len(points)),
+            offset=offset,
+            with_payload=["document"],
+            with_vectors=True
+        )
+        points.extend(batch)
+        if offset is None:
+            break
+    vectors = np.asarray([p.vector for p in points], dtype=np.float32)
+    documents = [p.payload.get("document", "") for p in points]
+    return vectors, documents
+
+
+# Нормированные случайные векторы размерности e5, документы по 200 чанков
+def synthetic_points(rng, count, dim):
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, [f"doc_{i // 200}.pdf" for i in range(count)]
+
+
+def build_collection(client, vectors, documents, quantization, hnsw_m, ef_construct, timeout):
+    if client.collection_exists(bench_collection):
+        client.delete_collection(bench_collection)
+    client.create_collection(
+        collection_name=bench_collection,
+        **collection_config(vectors.shape[1], hnsw_m, ef_construct, quantization, False)
+    )
+    ensure_payload_indexes(client, bench_collection)
+    started = time.perf_counter()
+    client.upload_points(
+        collection_name=bench_collection,
+        points=(
+            PointStruct(id=i, vector=vector.tolist(), payload={"document": document, "node_type": "chunk"})
+            for i, (vector, document) in enumerate(zip(vectors, documents))
+        ),
+        batch_size=256,
+        wait=True
+    )
+    # Индекс строится в фоне — замер начинается после перехода коллекции в green
+    while QDRANT_URL and time.perf_counter() - started < timeout:
+        if client.get_collection(bench_collection).status == "green":
+            break
+        time.sleep(0.5)
+    return time.perf_counter() - started
+
+
+def search(client, queries, k, params, filters):
+    results, times = [], []
+    for query, query_filter in zip(queries, filters):
+        started = time.perf_counter()
+        hits = client._client.search(
+            collection_name=bench_collection,
+            query_vector=query.tolist(),
+            query_filter=query_filter,
+            search_params=params,
+            limit=k
+        )
+        times.append(time.perf_counter() - started)
+        results.append([hit.id for hit in hits])
+    return results, np.asarray(times) * 1000
+
+
+def recall(results, truth, k):
+    return float(np.mean([len(set(r) & set(t[:k])) / max(min(k, len(t)), 1) for r, t in zip(results, truth)]))
+
+
+def report(title, results, times, truth, k):
+    print(f"  {title:34} recall@{k} {recall(results, truth, k):.4f}  "
+          f"p50 {np.percentile(times, 50):7.2f} мс  p95 {np.percentile(times, 95):7.2f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall и задержка поиска Qdrant при разных HNSW ef и квантизации")
+    parser.add_argument("--samples", type=int, default=20000, help="сколько чанков взять из collection_1")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="вместо чанков взять столько случайных векторов")
+    parser.add_argument("--dim", type=int, default=768,
+                        help="размерность синтетических векторов (768 — multilingual-e5-base)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--hnsw-m", type=int, default=QDRANT_HNSW_M)
+    parser.add_argument("--ef-construct", type=int, default=QDRANT_HNSW_EF_CONSTRUCT)
+    parser.add_argument("--oversampling", type=float, default=QDRANT_OVERSAMPLING)
+    parser.add_argument("--filtered", action="store_true",
+                        help="дополнительно искать внутри документа запроса (фильтр по payload)")
+    parser.add_argument("--index-timeout", type=float, default=600,
+                        help="сколько ждать построения индекса, с")
+    args = parser.parse_args()
+
+    if not QDRANT_URL:
+        print("Локальный Qdrant ищет полным перебором и игнорирует HNSW, квантизацию и индексы payload —\n"
+              "recall будет 1.0 при любых настройках. Для осмысленного замера задайте QDRANT_URL")
+
+    rng = np.random.default_rng(0)
+    client = QdrantClientSingleton.get_instance()
+    try:
+        if args.synthetic:
+            vectors, documents = synthetic_points(rng, args.synthetic, args.dim)
+        else:
+            vectors, documents = load_points(client, args.samples)
+        if not len(vectors):
+            print("Коллекция пуста — сначала запустите get_document.py или задайте --synthetic")
+            sys.exit(1)
+
+        # Запросы — зашумлённые векторы самих чанков, как близкие к тексту вопросы
+        picked = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+        queries = vectors[picked] + rng.normal(0, 0.02, (len(picked), vectors.shape[1])).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        filter_sets = [("без фильтра", [None] * len(picked))]
+        if args.filtered:
+            filter_sets.append(("по документу", [document_filter([documents[i]]) for i in picked]))
+        vector_mb = vectors.nbytes / 2 ** 20
+        print(f"Векторов: {len(vectors)} × {vectors.shape[1]}, запросов: {len(picked)}, "
+              f"float32 {vector_mb:.1f} МБ, int8 ≈{vector_mb / 4:.1f} МБ")
+
+        truth = {}
+        for quantization in (False, True):
+            seconds = build_collection(client, vectors, documents, quantization,
+                                       args.hnsw_m, args.ef_construct, args.index_timeout)
+            print(f"\n{'INT8' if quantization else 'float32'}: загрузка и индекс {seconds:.1f} с "
+                  f"(m={args.hnsw_m}, ef_construct={args.ef_construct})")
+            for label, filters in filter_sets:
+                print(f" {label}")
+                if label not in truth:
+                    truth[label], _ = search(client, queries, args.k, search_params(exact=True), filters)
+                exact, times = search(client, queries, args.k, search_params(exact=True), filters)
+                report("точный перебор", exact, times, truth[label], args.k)
+                for ef in args.ef:
+                    variants = [(f"ef={ef}", True)]
+                    if quantization:
+                        variants = [(f"ef={ef} без пересчёта", False),
+                                    (f"ef={ef} пересчёт x{args.oversampling:g}", True)]
+                    for title, rescore in variants:
+                        params = search_params(ef, quantization, args.oversampling, rescore)
+                        results, times = search(client, queries, args.k, params, filters)
+                        report(title, results, times, truth[label], args.k)
+        client.delete_collection(bench_collection)
+    finally:
+        QdrantClientSingleton.close()
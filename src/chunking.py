@@ -0,0 +1,99 @@
+import os
+from bisect import bisect_right
+
+# Размер чанка и перекрытие в токенах e5 (≈450 и ≈100 символов русского текста)
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "128"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "28"))
+
+# Сила границы между токенами: чем выше, тем охотнее по ней режем
+# (абзац, строка, конец предложения, пробел; 0 — середина слова)
+PARAGRAPH, LINE, SENTENCE, SPACE, INSIDE_WORD = 4, 3, 2, 1, 0
+
+# Корзины гистограммы размеров чанков в токенах
+TOKEN_BUCKETS = (16, 32, 64, 96, 128, 192, 256, 384, 512)
+
+
+def boundary_strength(text, offsets, k):
+    gap = text[offsets[k - 1][1]:offsets[k][0]]
+    if "\n\n" in gap:
+        return PARAGRAPH
+    if "\n" in gap:
+        return LINE
+    if gap and text[offsets[k - 1][1] - 1:offsets[k - 1][1]] in ".!?;:":
+        return SENTENCE
+    return SPACE if gap else INSIDE_WORD
+
+
+class TokenChunker:
+    def __init__(self, tokenizer, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("Перекрытие должно быть меньше размера чанка")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    # Лучшая граница в окне (start + max/2, start + max]: самая сильная,
+    # при равной силе — самая дальняя
+    def _split_point(self, strengths, start, end):
+        best = end
+        best_strength = -1
+        for k in range(end, start + max(self.max_tokens // 2, 1), -1):
+            if strengths[k] > best_strength:
+                best, best_strength = k, strengths[k]
+                if best_strength == PARAGRAPH:
+                    break
+        return best
+
+    # Начало следующего чанка: не раньше end - overlap и на границе слова
+    def _next_start(self, strengths, start, end):
+        for k in range(max(end - self.overlap_tokens, start + 1), end):
+            if strengths[k] >= SPACE:
+                return k
+        return end
+
+    # Документ токенизируется один раз; чанки режутся по индексам токенов,
+    # текст чанка — срез документа по смещениям его токенов
+    def split(self, text):
+        encoding = self.tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+        )
+        ids = encoding["input_ids"]
+        offsets = encoding["offset_mapping"]
+        n = len(ids)
+        if not n:
+            return []
+        strengths = [PARAGRAPH] + [boundary_strength(text, offsets, k) for k in range(1, n)] + [PARAGRAPH]
+
+        chunks = []
+        start = 0
+        while start < n:
+            end = min(start + self.max_tokens, n)
+            if end < n:
+                end = self._split_point(strengths, start, end)
+            chunk_text = text[offsets[start][0]:offsets[end - 1][1]].strip()
+            if chunk_text:
+                chunks.append({"content": chunk_text, "token_ids": ids[start:end]})
+            if end == n:
+                break
+            start = self._next_start(strengths, start, end)
+        return chunks
+
+
+def bucket_index(size, buckets=TOKEN_BUCKETS):
+    return bisect_right(buckets, size - 1)
+
+
+def token_histogram(sizes, buckets=TOKEN_BUCKETS):
+    counts = [0] * (len(buckets) + 1)
+    for size in sizes:
+        counts[bucket_index(size, buckets)] += 1
+    return counts
+
+
+def format_histogram(counts, buckets=TOKEN_BUCKETS):
+    labels = [f"≤{b}" for b in buckets] + [f">{buckets[-1]}"]
+    width = max(counts) or 1
+    return "\n".join(
+        f"  {label:>5}: {count:6d} {'#' * round(40 * count / width)}"
+        for label, count in zip(labels, counts) if count
+    )
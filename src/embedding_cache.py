@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+
+# Ограничение на число параметров в одном SQL-запросе
+SQL_BATCH = 500
+# Время последнего использования копится в памяти и пишется в базу
+# не чаще раза в столько секунд (или при записи новых векторов)
+TOUCH_FLUSH_INTERVAL = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+def vector_checksum(vector) -> int:
+    return zlib.crc32(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+
+
+# Кэш общий для процессов (индексация, сервис, консольные скрипты): выделение
+# слотов, запись векторов и индекса идут в одной транзакции BEGIN IMMEDIATE,
+# поэтому два процесса не займут один слот. Контрольная сумма вектора в индексе
+# отсекает чтение слота, который в этот момент перезаписывает другой процесс
+class EmbeddingCache:
+    def __init__(self, cache_dir, dim: int, max_entries: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._touched_flushed = time.monotonic()
+
+        self._db = sqlite3.connect(
+            str(self.cache_dir / "index.sqlite"), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        vectors_path = self.cache_dir / "vectors.f32"
+        with self._transaction():
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(entries)")}
+            if columns and "checksum" not in columns:
+                self._db.execute("DROP TABLE entries")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, slot INTEGER UNIQUE, last_used REAL, checksum INTEGER)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+            # Лимит берётся из уже созданного кэша: процесс с другим
+            # EMBEDDING_CACHE_SIZE не должен стирать общий файл. Заново кэш
+            # создаётся только при смене размерности или без файла векторов
+            meta = self._meta()
+            if meta.get("dim") == dim and vectors_path.exists():
+                if meta.get("max_entries") != max_entries:
+                    logger.info("Кэш эмбеддингов %s создан с лимитом %s, используется он",
+                                self.cache_dir, meta.get("max_entries"))
+                self.max_entries = meta["max_entries"]
+                mode = "r+"
+            else:
+                self._db.execute("DELETE FROM entries")
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                    [("dim", dim), ("max_entries", max_entries)]
+                )
+                self.max_entries = max_entries
+                mode = "w+"
+            self._vectors = np.memmap(
+                vectors_path, dtype=np.float32, mode=mode, shape=(self.max_entries, dim)
+            )
+
+    # Транзакция с блокировкой записи на всю базу: другие процессы ждут до timeout
+    @contextmanager
+    def _transaction(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    @staticmethod
+    def make_key(model_name: str, prefix: str, text: str) -> str:
+        return hashlib.sha1(f"{model_name}\0{prefix}\0{text}".encode("utf-8")).hexdigest()
+
+    def _meta(self):
+        return dict(self._db.execute("SELECT name, value FROM meta").fetchall())
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # Вызывается под self._lock внутри транзакции
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._touched.items()]
+            )
+            self._touched = {}
+        self._touched_flushed = time.monotonic()
+
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), SQL_BATCH):
+                part = keys[start:start + SQL_BATCH]
+                rows = self._db.execute(
+                    f"SELECT key, slot, checksum FROM entries WHERE key IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchall()
+                for key, slot, checksum in rows:
+                    vector = np.array(self._vectors[slot])
+                    if vector_checksum(vector) == checksum:
+                        found[key] = vector
+            now = time.time()
+            self._touched.update((key, now) for key in found)
+            if time.monotonic() - self._touched_flushed >= TOUCH_FLUSH_INTERVAL:
+                with self._transaction():
+                    self._flush_touched()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, keys, vectors):
+        items = dict(zip(keys, vectors))
+        if not items:
+            return
+        with self._lock, self._transaction():
+            self._flush_touched()
+            keys = list(items)
+            existing = {}
+            for start in range(0, len(keys), SQL_BATCH):
+                part = keys[start:start + SQL_BATCH]
+                existing.update(self._db.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(part))})",
+                    part
+                ).fetchall())
+            new_keys = [key for key in keys if key not in existing][:self.max_entries]
+
+            # Слоты заняты подряд с нуля: свободные берутся с конца,
+            # при переполнении освобождаются давно не использованные записи
+            size = len(self)
+            free_slots = list(range(size, min(size + len(new_keys), self.max_entries)))
+            n_evict = len(new_keys) - len(free_slots)
+            if n_evict > 0:
+                evicted = self._db.execute(
+                    "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (n_evict,)
+                ).fetchall()
+                self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                free_slots.extend(slot for _, slot in evicted)
+
+            slots = dict(existing)
+            slots.update(zip(new_keys, free_slots))
+            for key, slot in slots.items():
+                self._vectors[slot] = items[key]
+            self._vectors.flush()
+
+            now = time.time()
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entries (key, slot, last_used, checksum) VALUES (?, ?, ?, ?)",
+                [(key, slot, now, vector_checksum(items[key])) for key, slot in slots.items()]
+            )
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,82 @@
+import re
+from entity_rules import ENTITY_RULES
+
+
+# Самая длинная подстрока, которая обязана входить в любой текст, где
+# срабатывает шаблон, и признак того, что шаблон — просто литерал
+def required_literal(pattern: str):
+    if "|" in pattern or "(" in pattern:
+        return None, False
+    runs = []
+    run = ""
+    pure = True
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern):
+            escaped = pattern[i + 1]
+            if escaped.isalnum():
+                runs.append(run)
+                run = ""
+                pure = False
+            else:
+                run += escaped
+            i += 2
+            continue
+        if char == "[":
+            runs.append(run)
+            run = ""
+            pure = False
+            i = pattern.index("]", i + 2) + 1
+            continue
+        if char in "*?{":
+            # предыдущий символ необязателен
+            runs.append(run[:-1])
+            run = ""
+            pure = False
+            i = pattern.index("}", i) + 1 if char == "{" else i + 1
+            continue
+        if char in "+.^$":
+            runs.append(run)
+            run = ""
+            pure = False
+            i += 1
+            continue
+        run += char
+        i += 1
+    runs.append(run)
+    literal = max(runs, key=len)
+    return literal or None, pure and bool(literal)
+
+
+class EntityMatcher:
+    def __init__(self, rules):
+        self.rules = []
+        for entity, patterns in rules.items():
+            checks = []
+            for pattern in patterns:
+                literal, pure = required_literal(pattern)
+                checks.append((literal, None if pure else re.compile(pattern)))
+            self.rules.append((entity, checks))
+
+    # Шаблоны скомпилированы один раз; быстрая проверка подстроки (на C)
+    # отсекает почти все шаблоны, регулярка запускается только если
+    # обязательный литерал в тексте есть
+    def extract(self, text: str):
+        text = text.lower()
+        found = []
+        for entity, checks in self.rules:
+            for literal, regex in checks:
+                if literal is not None and literal not in text:
+                    continue
+                if regex is None or regex.search(text):
+                    found.append(entity)
+                    break
+        return found
+
+
+MATCHER = EntityMatcher(ENTITY_RULES)
+
+
+def extract_entities(text: str):
+    return MATCHER.extract(text)
@@ -0,0 +1,206 @@
+import argparse
+import logging
+import importlib
+import pathlib
+import time
+from datetime import date
+import numpy as np
+import openpyxl
+from openpyxl.styles import Alignment, Font
+from openpyxl.utils import get_column_letter
+
+root_project = pathlib.Path(__file__).absolute().parents[1]
+results_path = root_project / "test_results.xlsx"
+
+# Режим → (модуль, функция поиска, функция ответа LLM); модули импортируются
+# только для выбранных режимов, чтобы не поднимать лишние модели и соединения
+PIPELINES = {
+    "vector": ("get_answer", "retrieve_context", "get_llm_answer"),
+    "graph": ("get_answer_graph", "retrieve_context_from_graph", "get_llm_answer"),
+    "hybrid": ("get_answer_hybrid", "retrieve_context_hybrid", "get_llm_answer"),
+}
+# Короткие имена для названия листа (не длиннее 31 символа)
+SHORT_NAMES = {"vector": "vec", "graph": "graph", "hybrid": "hyb"}
+STAGES = ("encode", "search", "graph_search", "fusion", "rerank", "llm", "total")
+
+# Колонки как на листах, заполняемых вручную; оценки оставляются пустыми
+HEADER = (
+    "Вопрос", "Ответ", "Оценка работы ресивера (0-2)", "Оценка работы генератора (0-2)",
+    "Сумма", "Комментарий", None, "Средняя оценка точности, %",
+    "Режим", "Чанки", "Scores", *(f"{stage}, мс" for stage in STAGES)
+)
+COLUMN_WIDTHS = (37.4, 114.1, 18.7, 17.4, 7.6, 43.6, 9.4, 14.6, 9, 40, 30)
+
+
+def load_questions(path, sheet=None):
+    path = pathlib.Path(path)
+    if path.suffix == ".xlsx":
+        wb = openpyxl.load_workbook(path, read_only=True)
+        ws = wb[sheet] if sheet else wb.worksheets[0]
+        questions = [
+            row[0].strip() for row in ws.iter_rows(min_row=2, max_col=1, values_only=True)
+            if isinstance(row[0], str) and row[0].strip()
+        ]
+        wb.close()
+        return questions
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+# Ответ без Ollama: поиск и реранкинг можно мерить офлайн
+def stub_llm_answer(question, context):
+    return "[stub-llm] " + context[:200].replace("\n", " ")
+
+
+def load_pipeline(mode, stub_llm):
+    module_name, retrieve_name, llm_name = PIPELINES[mode]
+    module = importlib.import_module(module_name)
+    llm_answer = stub_llm_answer if stub_llm else getattr(module, llm_name)
+    return getattr(module, retrieve_name), llm_answer
+
+
+def run_question(retrieve, llm_answer, question):
+    timings = {}
+    started = time.perf_counter()
+    try:
+        context, chunks = retrieve(question, timings=timings)
+        llm_started = time.perf_counter()
+        answer = llm_answer(question, context)
+        timings["llm"] = time.perf_counter() - llm_started
+        error = None
+    except Exception as e:
+        answer, chunks, error = "", [], str(e)
+    timings["total"] = time.perf_counter() - started
+    return {"question": question, "answer": answer, "chunks": chunks, "timings": timings, "error": error}
+
+
+def run_mode(mode, questions, stub_llm):
+    retrieve, llm_answer = load_pipeline(mode, stub_llm)
+    results = []
+    for i, question in enumerate(questions, 1):
+        result = run_question(retrieve, llm_answer, question)
+        result["mode"] = mode
+        results.append(result)
+        status = f"ошибка: {result['error']}" if result["error"] else f"{result['timings']['total']:.2f} с"
+        print(f"[{mode}] {i}/{len(questions)} {status}")
+    return results
+
+
+# Режимы прогоняются по очереди, чтобы не делить ядра. Модели загружаются
+# до замеров, кэш эмбеддингов отключён, кэш реранкера очищается перед каждым
+# режимом — иначе режим, дошедший до вопроса вторым, получал бы готовые
+# эмбеддинги и оценки и его задержки нельзя было бы сравнить с первым
+def evaluate(questions, modes, stub_llm):
+    import get_model
+    import reranking
+    import warmup
+    get_model.Model.use_cache = False
+    warmup.warm_up(background=False)
+    results = {}
+    for mode in modes:
+        reranking.cache.clear()
+        results[mode] = run_mode(mode, questions, stub_llm)
+    return results
+
+
+def latency_summary(results):
+    summary = {}
+    for mode, rows in results.items():
+        for stage in STAGES:
+            values = [r["timings"][stage] * 1000 for r in rows if stage in r["timings"]]
+            if values:
+                summary[mode, stage] = (np.percentile(values, 50), np.percentile(values, 95))
+    return summary
+
+
+def sheet_title(wb, label):
+    base = f"{date.today():%d.%m.%Y}({label})"[:31]
+    title = base
+    n = 2
+    while title in wb.sheetnames:
+        suffix = f" {n}"
+        title = base[:31 - len(suffix)] + suffix
+        n += 1
+    return title
+
+
+def write_sheet(path, results, label):
+    path = pathlib.Path(path)
+    wb = openpyxl.load_workbook(path) if path.exists() else openpyxl.Workbook()
+    if not path.exists():
+        wb.remove(wb.active)
+    ws = wb.create_sheet(sheet_title(wb, label))
+    wb.active = wb.sheetnames.index(ws.title)
+
+    ws.append(HEADER)
+    for cell in ws[1]:
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(wrap_text=True, vertical="center", horizontal="center")
+    for i, width in enumerate(COLUMN_WIDTHS, 1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    for mode, rows in results.items():
+        for r in rows:
+            row = ws.max_row + 1
+            ws.append((
+                r["question"], r["answer"], None, None, f"=C{row}+D{row}",
+                f"Ошибка: {r['error']}" if r["error"] else None, None, None,
+                mode,
+                ", ".join(str(c["key"]) for c in r["chunks"]),
+                ", ".join(f"{c['score']:.3f}" for c in r["chunks"]),
+                *(round(r["timings"][s] * 1000, 1) if s in r["timings"] else None for s in STAGES)
+            ))
+            for col in (1, 2, 6, 10):
+                ws.cell(row, col).alignment = Alignment(wrap_text=True, vertical="top")
+    last_row = ws.max_row
+    ws["H2"] = f"=(AVERAGE(E2:E{last_row}))*100/4"
+
+    # Сводка: точность по режимам и p50/p95 задержек этапов
+    ws.append(())
+    ws.append(("Режим", "Этап", "p50, мс", "p95, мс", "Точность, %"))
+    for cell in ws[ws.max_row]:
+        cell.font = Font(bold=True)
+    for (mode, stage), (p50, p95) in latency_summary(results).items():
+        accuracy = (
+            f'=IFERROR(AVERAGEIF(I2:I{last_row},"{mode}",E2:E{last_row})*100/4,"")'
+            if stage == "total" else None
+        )
+        ws.append((mode, stage, round(p50, 1), round(p95, 1), accuracy))
+    wb.save(path)
+    return ws.title
+
+
+def print_summary(results):
+    print(f"\n{'режим':<8} {'этап':<13} {'p50, мс':>9} {'p95, мс':>9}")
+    for (mode, stage), (p50, p95) in latency_summary(results).items():
+        print(f"{mode:<8} {stage:<13} {p50:>9.1f} {p95:>9.1f}")
+    for mode, rows in results.items():
+        errors = sum(1 for r in rows if r["error"])
+        if errors:
+            print(f"{mode}: ошибок {errors} из {len(rows)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(
+        description="Прогон набора вопросов через векторный, графовый и гибридный поиск "
+                    "с записью результатов на новый лист test_results.xlsx"
+    )
+    parser.add_argument("--questions", default=str(results_path),
+                        help="файл вопросов: .txt (по вопросу в строке) или .xlsx (колонка «Вопрос»)")
+    parser.add_argument("--questions-sheet", default=None, help="лист с вопросами в .xlsx (по умолчанию первый)")
+    parser.add_argument("--modes", nargs="+", choices=list(PIPELINES), default=list(PIPELINES))
+    parser.add_argument("--stub-llm", action="store_true", help="не обращаться к Ollama, мерить только поиск")
+    parser.add_argument("--output", default=str(results_path), help="книга, в которую добавляется лист")
+    parser.add_argument("--label", default=None, help="подпись эксперимента в названии листа")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions, args.questions_sheet)
+    print(f"Вопросов: {len(questions)}, режимы: {', '.join(args.modes)}"
+          f"{', LLM-заглушка' if args.stub_llm else ''}")
+    results = evaluate(questions, args.modes, args.stub_llm)
+    print_summary(results)
+
+    label = args.label or ("+".join(SHORT_NAMES[m] for m in args.modes) + (" stub" if args.stub_llm else ""))
+    title = write_sheet(args.output, results, label)
+    print(f"\nРезультаты записаны на лист «{title}» в {args.output}")
@@ -1,159 +1,136 @@
-from get_qdrant_client import QdrantClientSingleton
-from langchain_ollama import OllamaLLM
-from langchain_core.prompts import PromptTemplate
-from get_model import Model
+from get_qdrant_client import QdrantClientSingleton, search_params, document_filter
+from get_llm import LLMAnswerer
+from prompts import vector_prompt
+import logging
 import pathlib
-from get_reranker import Reranker
+import micro_batcher
+import warmup
+import metrics
+import time
+from reranking import rerank_candidates, rank_by_similarity, cascade
+from streaming import stream_answer, print_streamed_answer
+from semantic_cache import cached_answer, cached_stream
 
 root_project = pathlib.Path(__file__).absolute().parents[1]
-reranker = Reranker.get_instance()
-client = QdrantClientSingleton.get_instance()
 collection_name = "collection_1"
-model = Model.get_instance()
-llm = OllamaLLM(model="mistral", temperature=0.1)
 
-prompt_template = PromptTemplate(
-    input_variables=["context", "question"],
-    template="""### Роль ###
-Ты — ассистент на базе внутренней базы знаний. Твоя задача — помочь инженеру проанализировать инцидент, найдя релевантную информацию в документации и прошлых решениях.
 
-### Источник данных ###
-Для ответа используй ИСКЛЮЧИТЕЛЬНО предоставленные ниже материалы из базы знаний:
-{context}
+# documents — имена файлов, которыми ограничить поиск (фильтр по payload-индексу)
+def search_candidates(question, n_results=15, final_k=5, similarity_threshold=0.3, timings=None,
+                      documents=None):
+    started = time.perf_counter()
+    query_embedding = micro_batcher.encode_query(question).tolist()
+    encoded = time.perf_counter()
 
-### Строгие инструкции ###
-
-1.  Анализ запроса: Разбери входящее сообщение на компоненты:
-    *   Система/сервис 
-    *   Компонент/модуль
-    *   Номер заявки/идентификатор
-    *   Текст ошибки/проблемы
-
-2.  Основа ответа: Каждое утверждение в ответе должно иметь прямое подтверждение в предоставленном контексте. Запрещено:
-    *   Придумывать команды, скрипты или пути
-    *   Расшифровывать аббревиатуры без их явного объяснения в контексте
-    *   Предполагать работу систем, не описанных в контексте
-
-3.  Структура ответа:
-
-    Интерпретация инцидента:
-    На основе запроса выявлены ключевые элементы: [перечисли элементы из п.1]. 
-    В контексте найдена следующая релевантная информация: [кратко опиши, что именно в контексте относится к этим элементам].
-
-    Рекомендуемые проверки из базы знаний:
-    [Строго на основе контекста предложи последовательность проверок. Если в контексте есть:
-    - Конкретные команды → укажи их
-    - Названия инструментов → укажи их
-    - Пути к логам → укажи их
-    - Процедуры проверки → опиши их
-    Если такой информации нет, не придумывай!]
-
-    Возможные решения из базы знаний:
-    [Если в контексте есть описание решения подобных проблем, перечисли их строго по материалам. Если нет, так и укажи.]
-
-    Для эскалации:
-    Если рекомендации не помогли или информация в базе знаний недостаточна:
-    - Убедись, что выполнены все проверки из статей [перечисли номера статей или названия из контекста]
-    - Подготовь данные для передачи в L3: [укажи, какие данные следует собрать согласно контексту]
-
-### Важно: ###
-- Если в контексте нет информации по какой-либо части запроса, прямо укажи это
-- Используй терминологию точно в том виде, в котором она представлена в контексте
-- Не добавляй интерпретации, не основанные на контексте
-
-### Вопрос инженера ###
-{question}"""
-)
-
-chain = prompt_template | llm
-
-
-def retrieve_context(question, n_results=15, final_k=5, similarity_threshold=0.3):
-    query_embedding = Model.encode_query([question])[0].tolist()
-
-    results = client._client.search(
+    results = QdrantClientSingleton.get_instance()._client.search(
         collection_name=collection_name,
         query_vector=query_embedding,
+        query_filter=document_filter(documents),
+        search_params=search_params(),
         limit=n_results
     )
-
-    documents = [hit.payload["text"] for hit in results]
-    metadatas = [hit.payload for hit in results]
-    similarities = [hit.score for hit in results]
-
-    filtered = [
-        (doc, meta, sim)
-        for doc, meta, sim in zip(documents, metadatas, similarities)
-        if sim >= similarity_threshold
+    if timings is not None:
+        timings["encode"] = encoded - started
+        timings["search"] = time.perf_counter() - encoded
+
+    candidates = [
+        {
+            "text": hit.payload["text"],
+            "metadata": hit.payload,
+            "similarity": float(hit.score),
+            "key": f'{hit.payload["doc_id"]}_{hit.payload["chunk_id"]}',
+            "point_id": str(hit.id)
+        }
+        for hit in results
     ]
 
-    if len(filtered) < final_k:
-        filtered = list(zip(documents, metadatas, similarities))
-
-    filtered_docs = [item[0] for item in filtered]
-    filtered_metas = [item[1] for item in filtered]
-    filtered_sims = [item[2] for item in filtered]
+    filtered = [c for c in candidates if c["similarity"] >= similarity_threshold]
 
-    pairs = [(question, doc) for doc in filtered_docs]
-    scores = reranker.predict(pairs)
-
-    ranked = sorted(
-        zip(filtered_docs, filtered_metas, filtered_sims, scores),
-        key=lambda x: x[3],
-        reverse=True
-    )
+    if len(filtered) < final_k:
+        filtered = candidates
+    metrics.observe("rag_candidates", len(filtered), metrics.SIZE_BUCKETS, mode="vector")
 
-    top_chunks = ranked[:final_k]
+    return filtered
 
-    context_docs = [item[0] for item in top_chunks]
 
-    chunks = []
-    for doc, meta, sim, score in top_chunks:
-        chunks.append({
-            "text": doc,
-            "metadata": meta,
-            "similarity": float(sim),
-            "score": float(score)
-        })
+def retrieve_context(question, n_results=15, final_k=5, similarity_threshold=0.3, timings=None,
+                     documents=None):
+    timings = {} if timings is None else timings
+    candidates = search_candidates(question, n_results, final_k, similarity_threshold, timings, documents)
+    started = time.perf_counter()
+    shortlist, decisive = cascade(candidates, final_k)
+    if decisive:
+        result = rank_by_similarity(candidates, final_k)
+    else:
+        result = rerank_candidates(question, shortlist, final_k)
+    timings["rerank"] = time.perf_counter() - started
+    metrics.record_timings(timings, mode="vector")
+    return result
 
-    context = "\n\n---SECTION---\n\n".join(context_docs)
 
-    return context, chunks
+_answerer = LLMAnswerer(vector_prompt, "vector")
+get_llm_answer = _answerer.answer
+aget_llm_answer = _answerer.aanswer
+stream_llm_answer = _answerer.stream
+astream_llm_answer = _answerer.astream
 
 
-def get_llm_answer(question, context):
-    return chain.invoke({"context": context[:1500], "question": question})
+def reranker_score(chunk):
+    if not chunk.get("reranked", True):
+        return "пропущен (явный лидер по similarity)"
+    return f"{chunk['score']:.4f}"
 
 
-def format_response(question, answer, source_chunks):
-    response = f"{answer}\n\nИсточники:\n"
+def format_sources(source_chunks):
+    response = "Источники:\n"
     for i, chunk in enumerate(source_chunks, 1):
         preview = chunk["text"][:300].replace("\n", " ") + "..."
         source = chunk["metadata"].get("document", "Unknown")
         response += (
             f"{i}. Источник: {source}\n"
             f"   Similarity (Qdrant): {chunk['similarity']:.4f}\n"
-            f"   Reranker score: {chunk['score']:.4f}\n"
+            f"   Reranker score: {reranker_score(chunk)}\n"
             f"   Текст: {preview}\n\n"
         )
     return response
 
 
-def enhanced_query_with_llm(question, n_results=5):
+def format_response(question, answer, source_chunks):
+    return f"{answer}\n\n{format_sources(source_chunks)}"
+
+
+def answer_question(question, n_results=5):
     context, chunks = retrieve_context(question, n_results=n_results)
-    answer = get_llm_answer(question, context)
-    return format_response(question, answer, chunks)
+    return get_llm_answer(question, context), chunks
 
 
-while True:
-    question = input("\nВведите вопрос: ")
-    if question.lower() == "стоп":
-        client.close()
-        break
+def enhanced_query_with_llm(question, n_results=5):
+    answer, chunks = cached_answer("vector", question, lambda: answer_question(question, n_results))
+    return format_response(question, answer, chunks)
+
 
-    try:
-        enhanced_response = enhanced_query_with_llm(question)
-        print(enhanced_response)
-    except Exception as e:
-        print("Ошибка при выполнении запроса:", e)
+def enhanced_query_with_llm_stream(question, n_results=5):
+    return cached_stream("vector", question, lambda q: stream_answer(
+        q,
+        lambda q: retrieve_context(q, n_results=n_results),
+        stream_llm_answer
+    ))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    metrics.serve()
+    if warmup.WARMUP:
+        warmup.warm_up()
+    print(warmup.format_prompt_ready())
+    while True:
+        question = input("\nВведите вопрос: ")
+        if question.lower() == "стоп":
+            QdrantClientSingleton.close()
+            break
+
+        try:
+            print_streamed_answer(enhanced_query_with_llm_stream(question), format_sources)
+        except Exception as e:
+            print("Ошибка при выполнении запроса:", e)
 
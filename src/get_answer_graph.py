@@ -1,145 +1,126 @@
-from neo4j import GraphDatabase
-from langchain_ollama import OllamaLLM
-from langchain_core.prompts import PromptTemplate
-from get_model import Model
-from get_reranker import Reranker
-import re
-import os
-from dotenv import load_dotenv
-from entity_rules import ENTITY_RULES
-
-load_dotenv()
-
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USER = os.getenv("NEO4J_USER")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-
-reranker = Reranker.get_instance()
-model = Model.get_instance()
-llm = OllamaLLM(model="mistral", temperature=0.1)
-
-prompt_template = PromptTemplate(
-    input_variables=["context", "question"],
-    template="""Ты эксперт в области оформления курсовых проектов и выпускных квалификационных работ. 
-Дай ответ, учитывая доступную тебе информацию из документа и, если указан, ГОСТ по оформлению в области российского образования.
-В первую очередь предоставляй информацию об оформлении документа, если в вопросе не указано иное. Если информации не хватает, не придумывай её и не добавляй ту информацию, которая не связана с вопросом.
-
-Documentation:
-{context}
-
-Question: {question}
-
-Answer (уточняй, приводи конкретные цифры и значения, когда это возможно):"""
-)
-
-chain = prompt_template | llm
-
-
-
-
-
-def extract_entities_from_question(question: str):
-    q = question.lower()
-    found = []
-
-    for entity, patterns in ENTITY_RULES.items():
-        for pattern in patterns:
-            if re.search(pattern, q):
-                found.append(entity)
-                break
-
-    return list(set(found))
-
-
-def retrieve_context_from_graph(question, final_k=5):
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
-
-    entities = extract_entities_from_question(question)
+from get_llm import LLMAnswerer
+from prompts import graph_prompt
+from entity_matcher import extract_entities
+from get_graph_client import GraphClientSingleton
+import logging
+import time
+import metrics
+import warmup
+from reranking import rerank_candidates
+from streaming import stream_answer, print_streamed_answer
+from semantic_cache import cached_answer, cached_stream
+
+
+# Чанки дедуплицируются и ранжируются в Neo4j по сумме IDF совпавших сущностей
+# вопроса; в реранкер уходят только top_n лучших кандидатов
+GRAPH_CANDIDATES_QUERY = """
+MATCH (c:Chunk)-[:MENTIONS]->(e:Entity)
+WHERE e.name IN $entities
+WITH c, collect(e.name) AS entities, sum(coalesce(e.idf, 1.0)) AS graph_score
+OPTIONAL MATCH (d:Document)-[:HAS_CHUNK]->(c)
+RETURN c.id AS chunk_id, c.point_id AS point_id, c.text AS text, entities, graph_score,
+       d.name AS document
+ORDER BY graph_score DESC, size(entities) DESC, chunk_id
+LIMIT $top_n
+"""
+
+
+def graph_candidates(question, top_n=15, timings=None):
+    started = time.perf_counter()
+    entities = extract_entities(question)
 
     if not entities:
-        return "", []
-
-    query = """
-    MATCH (c:Chunk)-[:MENTIONS]->(e:Entity)
-    WHERE e.name IN $entities
-    RETURN c.text AS text, e.name AS entity, c.id AS chunk_id
-    LIMIT 50
-    """
-
-    chunks = []
-
-    with driver.session() as session:
-        results = session.run(query, entities=entities)
-        for r in results:
-            chunks.append({
-                "text": r["text"],
-                "metadata": {
-                    "entity": r["entity"],
-                    "chunk_id": r["chunk_id"]
-                }
-            })
-
-    driver.close()
-
-    if not chunks:
-        return "", []
-
-    docs = [c["text"] for c in chunks]
-
-    pairs = [(question, doc) for doc in docs]
-    scores = reranker.predict(pairs)
-
-    ranked = sorted(
-        zip(chunks, scores),
-        key=lambda x: x[1],
-        reverse=True
-    )[:final_k]
-
-    context_docs = [item[0]["text"] for item in ranked]
-
-    final_chunks = []
-    for item, score in ranked:
-        final_chunks.append({
-            "text": item["text"],
-            "metadata": item["metadata"],
-            "score": float(score)
+        return []
+
+    results = GraphClientSingleton.get_instance().read(
+        GRAPH_CANDIDATES_QUERY, entities=entities, top_n=top_n
+    )
+    if timings is not None:
+        timings["graph_search"] = time.perf_counter() - started
+    metrics.observe("rag_candidates", len(results), metrics.SIZE_BUCKETS, mode="graph")
+
+    candidates = []
+    for r in results:
+        candidates.append({
+            "text": r["text"],
+            "metadata": {
+                "entity": ", ".join(r["entities"]),
+                "entities": r["entities"],
+                "chunk_id": r["chunk_id"],
+                "document": r["document"],
+                "graph_score": r["graph_score"]
+            },
+            "key": r["chunk_id"],
+            "point_id": r["point_id"]
         })
+    return candidates
 
-    context = "\n\n---SECTION---\n\n".join(context_docs)
 
-    return context, final_chunks
+def retrieve_context_from_graph(question, final_k=5, top_n=15, timings=None):
+    timings = {} if timings is None else timings
+    candidates = graph_candidates(question, top_n, timings)
+    started = time.perf_counter()
+    result = rerank_candidates(question, candidates, final_k)
+    timings["rerank"] = time.perf_counter() - started
+    metrics.record_timings(timings, mode="graph")
+    return result
 
 
-def get_llm_answer(question, context):
-    return chain.invoke({"context": context[:1500], "question": question})
+_answerer = LLMAnswerer(graph_prompt, "graph")
+get_llm_answer = _answerer.answer
+aget_llm_answer = _answerer.aanswer
+stream_llm_answer = _answerer.stream
+astream_llm_answer = _answerer.astream
 
 
-def format_response(answer, source_chunks):
-    response = f"{answer}\n\nИсточники (граф знаний):\n"
+def format_sources(source_chunks):
+    response = "Источники (граф знаний):\n"
     for i, chunk in enumerate(source_chunks, 1):
         preview = chunk["text"][:300].replace("\n", " ") + "..."
         entity = chunk["metadata"].get("entity", "Unknown")
         response += (
-            f"{i}. Сущность: {entity}\n"
+            f"{i}. Сущности: {entity}\n"
+            f"   Источник: {chunk['metadata'].get('document', 'Unknown')}\n"
+            f"   Graph score (IDF): {chunk['metadata'].get('graph_score', 0.0):.4f}\n"
             f"   Score: {chunk['score']:.4f}\n"
             f"   Текст: {preview}\n\n"
         )
     return response
 
 
-def enhanced_query_with_llm(question):
+def format_response(answer, source_chunks):
+    return f"{answer}\n\n{format_sources(source_chunks)}"
+
+
+def answer_question(question):
     context, chunks = retrieve_context_from_graph(question)
-    answer = get_llm_answer(question, context)
-    return format_response(answer, chunks)
+    return get_llm_answer(question, context), chunks
 
 
-while True:
-    question = input("\nВведите вопрос: ")
-    if question.lower() == "стоп":
-        break
+def enhanced_query_with_llm(question):
+    answer, chunks = cached_answer("graph", question, lambda: answer_question(question))
+    return format_response(answer, chunks)
+
 
-    try:
-        enhanced_response = enhanced_query_with_llm(question)
-        print(enhanced_response)
-    except Exception as e:
-        print("Ошибка при выполнении запроса:", e)
+def enhanced_query_with_llm_stream(question):
+    return cached_stream(
+        "graph", question, lambda q: stream_answer(q, retrieve_context_from_graph, stream_llm_answer)
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    metrics.serve()
+    if warmup.WARMUP:
+        warmup.warm_up()
+    print(warmup.format_prompt_ready())
+    while True:
+        question = input("\nВведите вопрос: ")
+        if question.lower() == "стоп":
+            break
+
+        try:
+            print_streamed_answer(enhanced_query_with_llm_stream(question), format_sources)
+        except Exception as e:
+            print("Ошибка при выполнении запроса:", e)
+    GraphClientSingleton.close()
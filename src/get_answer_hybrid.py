@@ -0,0 +1,166 @@
+import logging
+import os
+import time
+import metrics
+import warmup
+from concurrent.futures import ThreadPoolExecutor
+from get_llm import LLMAnswerer
+from prompts import graph_prompt
+from get_answer import search_candidates
+from get_qdrant_client import QdrantClientSingleton
+from get_answer_graph import graph_candidates
+from get_graph_client import GraphClientSingleton
+from reranking import rerank_candidates
+from streaming import stream_answer, print_streamed_answer
+from semantic_cache import cached_answer, cached_stream
+
+# Константа сглаживания reciprocal rank fusion
+RRF_K = 60
+
+# Векторный и графовый поиск идут параллельно в отдельных потоках: по два
+# потока на запрос, поэтому пул рассчитан на все одновременные запросы сервиса
+HYBRID_WORKERS = int(os.getenv(
+    "HYBRID_WORKERS", str(2 * int(os.getenv("SERVICE_MAX_CONCURRENT_REQUESTS", "16")))
+))
+executor = ThreadPoolExecutor(max_workers=HYBRID_WORKERS, thread_name_prefix="hybrid")
+
+
+# Кандидаты обоих списков сливаются по id чанка (doc_id_chunk_id),
+# итоговый балл — сумма 1 / (k + ранг) по спискам, где чанк встретился
+def reciprocal_rank_fusion(ranked_lists, k=RRF_K):
+    fused = {}
+    for source, candidates in ranked_lists.items():
+        for rank, candidate in enumerate(candidates, 1):
+            entry = fused.get(candidate["key"])
+            if entry is None:
+                entry = fused[candidate["key"]] = {
+                    "text": candidate["text"],
+                    "metadata": dict(candidate["metadata"]),
+                    "key": candidate["key"],
+                    "point_id": candidate.get("point_id"),
+                    "rrf_score": 0.0,
+                    "sources": []
+                }
+            else:
+                for field, value in candidate["metadata"].items():
+                    entry["metadata"].setdefault(field, value)
+                if not entry["point_id"]:
+                    entry["point_id"] = candidate.get("point_id")
+            if "similarity" in candidate:
+                entry["similarity"] = candidate["similarity"]
+            entry["rrf_score"] += 1.0 / (k + rank)
+            entry["sources"].append(source)
+    return sorted(fused.values(), key=lambda c: c["rrf_score"], reverse=True)
+
+
+def retrieve_context_hybrid(question, n_results=15, graph_top_n=15, rerank_top=20, final_k=5,
+                            timings=None):
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    vector_timings = {}
+    graph_timings = {}
+    vector_future = executor.submit(
+        search_candidates, question, n_results, final_k, timings=vector_timings
+    )
+    graph_future = executor.submit(graph_candidates, question, graph_top_n, graph_timings)
+    vector = vector_future.result()
+    try:
+        graph = graph_future.result()
+    except Exception as e:
+        print("Поиск по графу недоступен, используется только векторный:", e)
+        graph = []
+    timings.update(vector_timings)
+    timings.update(graph_timings)
+    timings["retrieval"] = time.perf_counter() - started
+
+    fusion_started = time.perf_counter()
+    candidates = reciprocal_rank_fusion({"vector": vector, "graph": graph})[:rerank_top]
+    metrics.observe("rag_candidates", len(candidates), metrics.SIZE_BUCKETS, mode="hybrid")
+    timings["fusion"] = time.perf_counter() - fusion_started
+
+    rerank_started = time.perf_counter()
+    context, chunks = rerank_candidates(question, candidates, final_k)
+    timings["rerank"] = time.perf_counter() - rerank_started
+    timings["total"] = time.perf_counter() - started
+    metrics.record_timings(timings, mode="hybrid")
+    return context, chunks
+
+
+_answerer = LLMAnswerer(graph_prompt, "hybrid")
+get_llm_answer = _answerer.answer
+aget_llm_answer = _answerer.aanswer
+stream_llm_answer = _answerer.stream
+astream_llm_answer = _answerer.astream
+
+
+def format_timings(timings):
+    if not timings:
+        return "ответ из семантического кэша"
+    return ", ".join(f"{stage}: {seconds * 1000:.0f} мс" for stage, seconds in timings.items())
+
+
+def format_sources(source_chunks):
+    response = "Источники (гибридный поиск):\n"
+    for i, chunk in enumerate(source_chunks, 1):
+        preview = chunk["text"][:300].replace("\n", " ") + "..."
+        meta = chunk["metadata"]
+        response += (
+            f"{i}. Источник: {meta.get('document', 'Unknown')}\n"
+            f"   Найден: {', '.join(chunk['sources'])}\n"
+            f"   Сущности: {meta.get('entity', '—')}\n"
+            f"   RRF: {chunk['rrf_score']:.4f}\n"
+            f"   Reranker score: {chunk['score']:.4f}\n"
+            f"   Текст: {preview}\n\n"
+        )
+    return response
+
+
+def format_response(answer, source_chunks, timings):
+    return f"{answer}\n\n{format_sources(source_chunks)}Этапы: {format_timings(timings)}\n"
+
+
+def answer_question(question, timings):
+    context, chunks = retrieve_context_hybrid(question, timings=timings)
+    started = time.perf_counter()
+    answer = get_llm_answer(question, context)
+    timings["llm"] = time.perf_counter() - started
+    return answer, chunks
+
+
+def enhanced_query_with_llm(question):
+    timings = {}
+    answer, chunks = cached_answer("hybrid", question, lambda: answer_question(question, timings))
+    return format_response(answer, chunks, timings)
+
+
+def enhanced_query_with_llm_stream(question):
+    return cached_stream(
+        "hybrid", question, lambda q: stream_answer(q, retrieve_context_hybrid, stream_llm_answer)
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    metrics.serve()
+    if warmup.WARMUP:
+        warmup.warm_up()
+    print(warmup.format_prompt_ready())
+    while True:
+        question = input("\nВведите вопрос: ")
+        if question.lower() == "стоп":
+            QdrantClientSingleton.close()
+            break
+
+        try:
+            timings = {}
+            events = cached_stream("hybrid", question, lambda q: stream_answer(
+                q,
+                lambda q: retrieve_context_hybrid(q, timings=timings),
+                stream_llm_answer
+            ))
+            print_streamed_answer(events, format_sources)
+            print(f"Этапы поиска: {format_timings(timings)}")
+        except Exception as e:
+            print("Ошибка при выполнении запроса:", e)
+    executor.shutdown()
+    GraphClientSingleton.close()
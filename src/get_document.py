@@ -1,240 +1,310 @@
 from pathlib import Path
-from markitdown import MarkItDown
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from collections import Counter
+import logging
 import os
+import time
 import get_model
-from qdrant_client.models import VectorParams, Distance, PointStruct
-import uuid
-from get_qdrant_client import QdrantClientSingleton
-import pdfplumber
-import replicate
-import io
-from PIL import Image
-import pymorphy3
-import re
-
-def call_dots_ocr(image: Image.Image) -> str:
-    img_bytes = io.BytesIO()
-    image.save(img_bytes, format='PNG')
-    img_bytes = img_bytes.getvalue()
-    output = replicate.run(
-        "rednote-ai/dots-ocr:dots-ocr-1.5",
-        input={
-            "image": img_bytes,
-            "prompt_mode": "prompt_layout_all_en"
-        }
-    )
-    if isinstance(output, str):
-        return output
-    else:
-        return ' '.join(output)
-
-#решение для узких ячеек таблиц
-def merge_split_words(text: str) -> str:
-    morph = pymorphy3.MorphAnalyzer()
-    words = text.split()
-    if len(words) < 2:
-        return text
-    merged = []
-    i = 0
-    while i < len(words):
-        if i + 1 < len(words):
-            candidate = words[i] + words[i + 1]
-            if morph.word_is_known(candidate):
-                merged.append(candidate)
-                i += 2
-                continue
-        merged.append(words[i])
-        i += 1
-    return ' '.join(merged)
-
-#извлечение текста
-def process_document(path):
-    pages_text = []
-    with pdfplumber.open(path) as pdf:
-        for page in pdf.pages:
-            lines = page.extract_text_lines()
-            tables = page.find_tables()
-            table_bboxes = [t.bbox for t in tables]
-
-            if not tables:
-                text = page.extract_text()
-                if text:
-                    pages_text.append(text)
-                continue
-            all_items = []
-            for line in lines:
-                inside = False
-                for tx0, ty0, tx1, ty1 in table_bboxes:
-                    if (line['x0'] >= tx0 and line['x1'] <= tx1 and
-                        line['top'] >= ty0 and line['bottom'] <= ty1):
-                        inside = True
-                        break
-                if not inside:
-                    all_items.append((line['top'], line['text']))
-            for t in tables:
-                cells = t.extract()
-                if not cells:
-                    continue
-                cell_bboxes = t.cells if hasattr(t, 'cells') else None
-                rows_text = []
-                for i, row in enumerate(cells):
-                    row_parts = []
-                    for j, cell in enumerate(row):
-                        if cell is None:
-                            row_parts.append('')
-                            continue
-                        cell_clean = ' '.join(cell.split())
-                        if ' ' not in cell_clean and len(cell_clean) > 15:
-                            if cell_bboxes and i < len(cell_bboxes) and j < len(cell_bboxes[i]):
-                                bbox_raw = cell_bboxes[i][j]
-                                if isinstance(bbox_raw, dict):
-                                    bbox = (bbox_raw.get('x0'), bbox_raw.get('top'),
-                                            bbox_raw.get('x1'), bbox_raw.get('bottom'))
-                                elif isinstance(bbox_raw, (list, tuple)) and len(bbox_raw) == 4:
-                                    bbox = tuple(bbox_raw)
-                                else:
-                                    bbox = None
-                                if bbox and all(isinstance(v, (int, float)) for v in bbox):
-                                    try:
-                                        cell_img = page.within_bbox(bbox).to_image(resolution=150).original
-                                        ocr_text = call_dots_ocr(cell_img)
-                                        if ocr_text:
-                                            cell_clean = ' '.join(ocr_text.split())
-                                    except Exception as e:
-                                        print(f"OCR failed for cell ({i},{j}): {e}")
-                        row_parts.append(cell_clean)
-                    row_text = ' '.join(row_parts).strip()
-                    if row_text:
-                        row_text = merge_split_words(row_text)
-                        rows_text.append(row_text)
-                y0 = t.bbox[1]
-                for idx, row_text in enumerate(rows_text):
-                    all_items.append((y0 + idx * 0.1, row_text))
-            all_items.sort(key=lambda x: x[0])
-            page_text = '\n'.join(text for _, text in all_items)
-            pages_text.append(page_text)
-    text = '\n'.join(pages_text)
-    text = re.sub(r"([А-Яа-яЁёA-Za-z])\-\s*\n\s*([А-Яа-яЁёA-Za-z])", r"\1\2", text)
-    return {"content": text, "source": path}
+import metrics
+from qdrant_client.models import PointStruct
+import argparse
+from get_qdrant_client import QdrantClientSingleton, collection_config, ensure_payload_indexes
+from pdf_extraction import extract_documents, PAGES_PER_TASK
+from ingest_manifest import IngestManifest, file_sha256, text_sha1, chunk_point_id
+from chunking import TokenChunker, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, TOKEN_BUCKETS, bucket_index, format_histogram
 
 
 #Получение пути к документам
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
-model = get_model.Model.get_instance()
 output_folder = os.path.join(parent_dir, 'documents')
-files_in_documents = list(Path(output_folder).glob('*'))
+root_project = Path(__file__).absolute().parents[1]
+manifest_path = root_project / 'ingest_manifest.json'
+# Метрики прогона (включая OCR из процессов пула) в формате Prometheus
+metrics_path = os.getenv("METRICS_TEXTFILE", str(root_project / 'model' / 'ingest_metrics.prom'))
+collection_name = "collection_1"
 
 # Чанкирование и подготовка данных
-md = MarkItDown()
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=450,
-    chunk_overlap=100,
-    separators=["\n\n", "\n", ". ", " ", ""]
-)
-
-def split_into_chunks(doc, text_splitter):
-    doc_chunks = text_splitter.split_text(doc["content"])
-    return [{"content": chunk, "source": doc["source"]} for chunk in doc_chunks]
-
-allowed_ext = {".pdf", ".docx", ".txt"}
-
-files_in_documents = [
-    p for p in Path(output_folder).glob("*")
-    if p.suffix.lower() in allowed_ext
-]
-all_processed_docs = []
-
-for file_path in files_in_documents:
-    try:
-        print(f"Обработка документа: {file_path} ...")
-        proc_doc = process_document(file_path)
-        print(f"Документ обработан: {proc_doc['source'].name}")
-        all_processed_docs.append(proc_doc)
-    except Exception as e:
-        print(f"Ошибка обработки: {file_path}: {e}")
-
-all_chunks = []
-previous_chunks_num = 0
-
+# Чанки режутся токенизатором e5 и не длиннее бюджета модели (512 с префиксом
+# и спецтокенами), поэтому при эмбеддинге ничего не обрезается
+def get_chunker(max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    model = get_model.Model
+    return TokenChunker(
+        model.get_instance().tokenizer,
+        min(max_tokens, model.token_budget("passage")),
+        overlap_tokens
+    )
 
-for doc in all_processed_docs:
-    doc_chunks = split_into_chunks(doc, text_splitter)
-    all_chunks.extend(doc_chunks)
 
-source_counts = Counter(chunk["source"] for chunk in all_chunks)
-chunk_lengths = [len(chunk["content"]) for chunk in all_chunks]
+def split_into_chunks(doc, chunker):
+    return [
+        {"content": chunk["content"], "token_ids": chunk["token_ids"], "source": doc["source"]}
+        for chunk in chunker.split(doc["content"])
+    ]
 
-print(f"Всего создано чанков: {len(all_chunks)}")
-print(f"Размер чанков: {min(chunk_lengths)}-{max(chunk_lengths)} символов")
+allowed_ext = {".pdf", ".docx", ".txt"}
 
-documents = []
-metadatas = []
-ids = []
+# Сколько чанков эмбеддится и записывается в Qdrant за один раз
+BATCH_SIZE = 64
+# Манифест со всеми id точек пишется целиком, поэтому не чаще раза в столько
+# секунд и в конце прогона; при сбое теряется только этот интервал —
+# документы переиндексируются с теми же детерминированными id
+MANIFEST_SAVE_INTERVAL = 30.0
+# Запись в Qdrant: размер запроса и число параллельных загрузчиков
+# (параллельность действует только на сервере, локальная база пишет в один поток)
+UPLOAD_BATCH_SIZE = int(os.getenv("QDRANT_UPLOAD_BATCH_SIZE", "64"))
+UPLOAD_PARALLEL = int(os.getenv("QDRANT_UPLOAD_PARALLEL", "1"))
 
-for doc_id, doc in enumerate(all_processed_docs):
-    doc_chunks = split_into_chunks(doc, text_splitter)
 
+def build_points(doc_name, doc_id, doc_chunks):
+    points = []
     for chunk_id, chunk in enumerate(doc_chunks):
-        documents.append(chunk["content"])
-
-        metadatas.append({
-            "document": Path(chunk["source"]).name,
-            "doc_id": doc_id,
-            "chunk_id": chunk_id
-        })
-
-        ids.append(f"{doc_id}_{chunk_id}")
-
-# Получение эмбеддингов
-print(f"Генерация эмбеддингов...")
-embeddings = get_model.Model.encode_passages(documents)
-
-print(f"Результат генерации эмбеддингов:")
-print(f"  - Форма эмбеддинга: {embeddings.shape}")
-print(f"  - Измерений векторов: {embeddings.shape[1]}")
-
-#Построение базы знаний (Qdrant)
-root_project = Path(__file__).absolute().parents[1]
-client = QdrantClientSingleton.get_instance()
-
-try:
-    client.delete_collection("collection_1")
-except:
-    pass
-
-collection_name = "collection_1"
-
-client.create_collection(
-    collection_name=collection_name,
-    vectors_config=VectorParams(size=embeddings.shape[1], distance=Distance.COSINE)
-)
-
-print(f"Создана коллекция: {collection_name}")
-
-points = []
-
-for idx, (vector, text, meta) in enumerate(zip(embeddings, documents, metadatas)):
-    points.append(
-        PointStruct(
-            id=str(uuid.uuid4()),
-            vector=vector.tolist(),
-            payload={
-                "text": text,
-                **meta,
-                "node_type": "chunk"
+        text_hash = text_sha1(chunk["content"])
+        points.append({
+            "id": chunk_point_id(doc_name, chunk_id, text_hash),
+            "text": chunk["content"],
+            "token_ids": chunk["token_ids"],
+            "metadata": {
+                "document": doc_name,
+                "doc_id": doc_id,
+                "chunk_id": chunk_id,
+                "text_hash": text_hash
             }
-        )
+        })
+    return points
+
+
+# Индексы payload создаются и для уже существующей коллекции,
+# чтобы старые базы получили фильтрацию по документу без переиндексации
+def ensure_collection(client, full_rebuild):
+    exists = client.collection_exists(collection_name)
+    if exists and not full_rebuild:
+        ensure_payload_indexes(client, collection_name)
+        return False
+    if exists:
+        client.delete_collection(collection_name)
+    dim = get_model.Model.get_instance().get_sentence_embedding_dimension()
+    client.create_collection(collection_name=collection_name, **collection_config(dim))
+    ensure_payload_indexes(client, collection_name)
+    print(f"Создана коллекция: {collection_name}")
+    return True
+
+
+def delete_points(client, point_ids):
+    if point_ids:
+        client.delete(collection_name=collection_name, points_selector=list(point_ids))
+
+
+def upsert_points(client, points, parallel=UPLOAD_PARALLEL):
+    if not points:
+        return
+    embeddings = get_model.Model.encode_passages(
+        [p["text"] for p in points], [p["token_ids"] for p in points]
+    )
+    client.upload_points(
+        collection_name=collection_name,
+        batch_size=UPLOAD_BATCH_SIZE,
+        parallel=parallel,
+        wait=True,
+        points=[
+            PointStruct(
+                id=p["id"],
+                vector=vector.tolist(),
+                payload={
+                    "text": p["text"],
+                    **p["metadata"],
+                    "node_type": "chunk"
+                }
+            )
+            for p, vector in zip(points, embeddings)
+        ]
     )
 
-client.upsert(
-    collection_name=collection_name,
-    points=points
-)
-
-print(f"Всего в коллекции: {client.get_collection(collection_name).points_count}")
 
-client.close()
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def commit_document(manifest, doc):
+    manifest.update(doc["name"], doc["hash"], doc["doc_id"], doc["point_ids"])
+
+
+# Коллекция без манифеста (построена до появления инкрементальной индексации
+# или манифест удалён): её id точек неизвестны, старые чанки нельзя удалить,
+# и при дозаписи каждый чанк оказался бы в поиске дважды
+def collection_without_manifest(client, manifest):
+    if manifest.documents or not client.collection_exists(collection_name):
+        return False
+    return bool(client.get_collection(collection_name).points_count)
+
+
+# Поток чанков, которые нужно заэмбеддить: документы читаются по одному,
+# устаревшие чанки удаляются сразу, документ попадает в манифест только
+# после того, как все его новые чанки записаны в Qdrant
+def iter_new_points(results, client, manifest, file_hashes, stats, chunk_sizes, failures, chunker):
+    for result in results:
+        file_path = result["source"]
+        doc_name = file_path.name
+        if result["error"]:
+            print(f"Ошибка обработки: {file_path}: {result['error']}")
+            failures.append((doc_name, result["error"]))
+            stats["failed"] += 1
+            continue
+        metrics.observe("rag_stage_seconds", result["work_time"], stage="process_document")
+        metrics.observe("rag_document_pages", result["pages"], metrics.SIZE_BUCKETS)
+        print(
+            f"Документ обработан: {doc_name} "
+            f"(страниц: {result['pages']}, в работе {result['work_time']:.1f} с, CPU {result['cpu_time']:.1f} с, "
+            f"с ожиданием в очереди {result['elapsed']:.1f} с)"
+        )
 
+        doc_id = manifest.doc_id_for(doc_name)
+        points = build_points(doc_name, doc_id, split_into_chunks(result, chunker))
+        for p in points:
+            length = len(p["text"])
+            chunk_sizes["min"] = min(chunk_sizes["min"], length)
+            chunk_sizes["max"] = max(chunk_sizes["max"], length)
+            tokens = len(p["token_ids"])
+            chunk_sizes["min_tokens"] = min(chunk_sizes["min_tokens"], tokens)
+            chunk_sizes["max_tokens"] = max(chunk_sizes["max_tokens"], tokens)
+            chunk_sizes["histogram"][bucket_index(tokens)] += 1
+            metrics.observe("rag_chunk_tokens", len(p["token_ids"]), metrics.SIZE_BUCKETS)
+        stats["chunks"] += len(points)
+        old_ids = manifest.point_ids(doc_name)
+        new_points = [p for p in points if p["id"] not in old_ids]
+        stale_ids = old_ids - {p["id"] for p in points}
+
+        delete_points(client, stale_ids)
+        stats["updated" if old_ids else "added"] += 1
+        stats["deleted_chunks"] += len(stale_ids)
+
+        doc = {
+            "name": doc_name,
+            "hash": file_hashes[file_path],
+            "doc_id": doc_id,
+            "point_ids": [p["id"] for p in points],
+            "left": len(new_points)
+        }
+        if not new_points:
+            commit_document(manifest, doc)
+            continue
+        for point in new_points:
+            yield doc, point
+
+
+def ingest(full_rebuild=False, max_workers=None, pages_per_task=PAGES_PER_TASK, batch_size=BATCH_SIZE,
+           upload_parallel=UPLOAD_PARALLEL):
+    files_in_documents = [
+        p for p in Path(output_folder).glob("*")
+        if p.suffix.lower() in allowed_ext
+    ]
+    client = QdrantClientSingleton.get_instance()
+    manifest = IngestManifest.load(manifest_path)
+
+    if not full_rebuild and collection_without_manifest(client, manifest):
+        print(f"Коллекция {collection_name} есть, а манифеста нет — полная переиндексация")
+        full_rebuild = True
+
+    # Без коллекции манифест не имеет смысла — строим всё заново
+    if ensure_collection(client, full_rebuild):
+        manifest.reset()
+
+    stats = Counter()
+    current_names = set()
+    # Только счётчики: память не растёт вместе с корпусом
+    chunk_sizes = {"min": float("inf"), "max": 0, "min_tokens": float("inf"), "max_tokens": 0,
+                   "histogram": [0] * (len(TOKEN_BUCKETS) + 1)}
+    failures = []
+
+    file_hashes = {}
+    for file_path in files_in_documents:
+        doc_name = file_path.name
+        current_names.add(doc_name)
+        file_hash = file_sha256(file_path)
+        if manifest.is_unchanged(doc_name, file_hash):
+            stats["skipped"] += 1
+            continue
+        file_hashes[file_path] = file_hash
+
+    started = time.perf_counter()
+    print(f"Обработка {len(file_hashes)} документов...")
+    results = extract_documents(list(file_hashes), max_workers, pages_per_task)
+    # Токенизатор (и вместе с ним e5 и torch) нужен, только если есть что индексировать
+    chunker = get_chunker() if file_hashes else None
+    new_points = iter_new_points(results, client, manifest, file_hashes, stats, chunk_sizes, failures, chunker)
+
+    saved = time.perf_counter()
+    for batch in iter_batches(new_points, batch_size):
+        upsert_points(client, [point for _, point in batch], upload_parallel)
+        stats["embedded"] += len(batch)
+        for doc, _ in batch:
+            doc["left"] -= 1
+            if doc["left"] == 0:
+                commit_document(manifest, doc)
+        if time.perf_counter() - saved >= MANIFEST_SAVE_INTERVAL:
+            manifest.save()
+            saved = time.perf_counter()
+    manifest.save()
+
+    print(f"Обработка документов заняла {time.perf_counter() - started:.1f} с")
+    for doc_name, error in failures:
+        print(f"  - не обработан: {doc_name}: {error}")
+
+    # Удаление чанков документов, которых больше нет в папке
+    for doc_name in list(manifest.documents):
+        if doc_name not in current_names:
+            delete_points(client, manifest.point_ids(doc_name))
+            manifest.remove(doc_name)
+            stats["removed"] += 1
+    manifest.save()
+
+    print(
+        f"Добавлено: {stats['added']}, обновлено: {stats['updated']}, "
+        f"без изменений: {stats['skipped']}, удалено: {stats['removed']}, "
+        f"ошибок: {stats['failed']}"
+    )
+    if stats["chunks"]:
+        print(f"Всего создано чанков: {stats['chunks']}")
+        print(f"Размер чанков: {chunk_sizes['min']}-{chunk_sizes['max']} символов, "
+              f"{chunk_sizes['min_tokens']}-{chunk_sizes['max_tokens']} токенов "
+              f"(лимит {chunker.max_tokens})")
+        print("Распределение чанков по числу токенов:")
+        print(format_histogram(chunk_sizes["histogram"]))
+    print(f"Новых эмбеддингов: {stats['embedded']}, удалено устаревших чанков: {stats['deleted_chunks']}")
+    if get_model.Model.throughput():
+        print(f"Скорость эмбеддинга: {get_model.Model.throughput():.1f} пассажей/с "
+              f"(размер бакета {get_model.Model.batch_size})")
+    print(f"Всего в коллекции: {client.get_collection(collection_name).points_count}")
+    if metrics.write_textfile(metrics_path):
+        print(f"Метрики прогона записаны в {metrics_path}")
+
+    QdrantClientSingleton.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    metrics.serve()
+    parser = argparse.ArgumentParser(description="Построение векторной базы Qdrant")
+    parser.add_argument("--full", action="store_true",
+                        help="удалить коллекцию и переиндексировать все документы")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число процессов для извлечения текста (по умолчанию — число ядер)")
+    parser.add_argument("--pages-per-task", type=int, default=PAGES_PER_TASK,
+                        help="сколько страниц большого PDF обрабатывает один процесс за задачу")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="сколько чанков эмбеддить и записывать за один запрос к Qdrant")
+    parser.add_argument("--embed-batch-size", type=int, default=get_model.EMBED_BATCH_SIZE,
+                        help="размер бакета при эмбеддинге (тексты сортируются по длине в токенах)")
+    parser.add_argument("--upload-parallel", type=int, default=UPLOAD_PARALLEL,
+                        help="число параллельных загрузчиков в Qdrant (только для сервера)")
+    args = parser.parse_args()
+    get_model.Model.batch_size = args.embed_batch_size
+    ingest(full_rebuild=args.full, max_workers=args.workers,
+           pages_per_task=args.pages_per_task, batch_size=args.batch_size,
+           upload_parallel=args.upload_parallel)
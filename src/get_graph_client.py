@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from neo4j import GraphDatabase
+from neo4j.exceptions import ServiceUnavailable, SessionExpired
+from dotenv import load_dotenv
+
+load_dotenv()
+
+NEO4J_URI = os.getenv("NEO4J_URI")
+NEO4J_USER = os.getenv("NEO4J_USER")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+# Размер пула соединений драйвера (общий для всех потоков сервиса)
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+NEO4J_MAX_RETRIES = int(os.getenv("NEO4J_MAX_RETRIES", "5"))
+# Пауза перед первым повтором, дальше удваивается
+NEO4J_RETRY_BACKOFF = float(os.getenv("NEO4J_RETRY_BACKOFF", "0.5"))
+
+
+class GraphClient:
+    def __init__(self, uri, user, password, pool_size=NEO4J_POOL_SIZE,
+                 max_retries=NEO4J_MAX_RETRIES, retry_backoff=NEO4J_RETRY_BACKOFF):
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.driver = GraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_lifetime=300,
+            max_connection_pool_size=pool_size,
+            connection_acquisition_timeout=30,
+            connection_timeout=30,
+            liveness_check_timeout=60
+        )
+
+    def close(self):
+        self.driver.close()
+
+    def _with_retries(self, work):
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries):
+            try:
+                with self.driver.session() as session:
+                    return work(session)
+            except (ServiceUnavailable, SessionExpired) as e:
+                print(f"Neo4j connection lost, retry {attempt + 1}/{self.max_retries}...")
+                time.sleep(delay)
+                delay *= 2
+        raise RuntimeError("Neo4j connection failed after retries")
+
+    def run(self, query, **params):
+        return self._with_retries(lambda session: session.run(query, params).data())
+
+    def read(self, query, **params):
+        return self._with_retries(
+            lambda session: session.execute_read(lambda tx: tx.run(query, params).data())
+        )
+
+    # Каждый батч строк уходит одной транзакцией UNWIND $rows в общей сессии;
+    # повторы при обрыве соединения выполняет сам драйвер в execute_write
+    def run_batches(self, query, rows, batch_size):
+        with self.driver.session() as session:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                session.execute_write(lambda tx, batch=batch: tx.run(query, rows=batch).consume())
+        return len(rows)
+
+    def health_check(self):
+        started = time.perf_counter()
+        try:
+            self.driver.verify_connectivity()
+            self.run("RETURN 1 AS ok")
+        except Exception as e:
+            return {"ok": False, "error": str(e), "latency": time.perf_counter() - started}
+        return {"ok": True, "latency": time.perf_counter() - started}
+
+
+class GraphClientSingleton:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = GraphClient(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
+            return cls._instance
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.close()
+                cls._instance = None
+
+
+# Состояние Neo4j для /health: None, если граф не настроен (только векторный
+# поиск); ошибка создания драйвера (неверный URI) — как недоступность
+def health_check():
+    if not NEO4J_URI:
+        return None
+    try:
+        graph = GraphClientSingleton.get_instance()
+    except Exception as e:
+        return {"ok": False, "error": str(e), "latency": 0.0}
+    return graph.health_check()
+
+
+if __name__ == "__main__":
+    graph = GraphClientSingleton.get_instance()
+    status = graph.health_check()
+    if status["ok"]:
+        print(f"Neo4j доступен: {NEO4J_URI}, ответ за {status['latency'] * 1000:.1f} мс, "
+              f"пул до {NEO4J_POOL_SIZE} соединений")
+    else:
+        print(f"Neo4j недоступен: {NEO4J_URI}: {status['error']}")
+    GraphClientSingleton.close()
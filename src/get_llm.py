@@ -0,0 +1,61 @@
+import threading
+import metrics
+
+model_name = "mistral"
+# Сколько символов контекста уходит в промпт
+CONTEXT_CHARS = 1500
+
+
+class LLM:
+    _instance = None
+    _chains = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    from langchain_ollama import OllamaLLM
+                    cls._instance = OllamaLLM(model=model_name, temperature=0.1)
+        return cls._instance
+
+    # Цепочка «промпт | LLM» собирается один раз на промпт
+    @classmethod
+    def chain(cls, prompt):
+        chain = cls._chains.get(id(prompt))
+        if chain is None:
+            llm = cls.get_instance()
+            with cls._lock:
+                chain = cls._chains.setdefault(id(prompt), prompt | llm)
+        return chain
+
+
+# Вызовы LLM одного режима: промпт и метка mode для метрик. Скрипты режимов
+# берут отсюда get_llm_answer / aget_llm_answer / stream_llm_answer / astream_llm_answer
+class LLMAnswerer:
+    def __init__(self, prompt, mode):
+        self.prompt = prompt
+        self.mode = mode
+
+    def _inputs(self, question, context):
+        return {"context": context[:CONTEXT_CHARS], "question": question}
+
+    def _observe(self, context):
+        metrics.observe("rag_context_chars", len(context), metrics.SIZE_BUCKETS, mode=self.mode)
+
+    def answer(self, question, context):
+        self._observe(context)
+        with metrics.span("llm", mode=self.mode):
+            return LLM.chain(self.prompt).invoke(self._inputs(question, context))
+
+    async def aanswer(self, question, context):
+        self._observe(context)
+        with metrics.span("llm", mode=self.mode):
+            return await LLM.chain(self.prompt).ainvoke(self._inputs(question, context))
+
+    def stream(self, question, context):
+        return LLM.chain(self.prompt).stream(self._inputs(question, context))
+
+    def astream(self, question, context):
+        return LLM.chain(self.prompt).astream(self._inputs(question, context))
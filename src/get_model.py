@@ -1,46 +1,217 @@
-from sentence_transformers import SentenceTransformer
+import logging
 import os
 from pathlib import Path
+import threading
+import time
+import numpy as np
+from embedding_cache import EmbeddingCache
+import metrics
+from backends import backend_from_env, load_kwargs, quantize_int8
 model_name = "intfloat/multilingual-e5-base"
+# Лимит дискового кэша эмбеддингов (0 — кэш выключен)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "200000"))
+# Размер бакета: тексты близкой длины в токенах эмбеддятся одним прогоном
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBEDDER_BACKEND = backend_from_env("EMBEDDER_BACKEND")
+
+logger = logging.getLogger(__name__)
+
+
 class Model:
     _instance = None
+    _cache = None
+    _lock = threading.Lock()
+    _prefix_ids = {}
+    load_seconds = None
+    batch_size = EMBED_BATCH_SIZE
+    backend = EMBEDDER_BACKEND
+    # False — кэш эмбеддингов не читается и не пополняется (замеры задержки)
+    use_cache = True
+    _stats_lock = threading.Lock()
+    _encoded_texts = 0
+    _encode_seconds = 0.0
     @classmethod
-    def get_instance(cls):
-        if cls._instance is None:
-            root_project = Path(__file__).absolute().parents[1]
-            model_cache_dir = root_project / 'model'
-            model_cache_dir.mkdir(parents=True, exist_ok=True)
-            os.environ["SENTENCE_TRANSFORMERS_HOME"] = str(model_cache_dir)
-            os.environ["TRANSFORMERS_CACHE"] = str(model_cache_dir)
+    def load(cls, backend=None):
+        # sentence_transformers тянет torch — импорт только при реальной загрузке
+        from sentence_transformers import SentenceTransformer
+        backend = backend or cls.backend
+        root_project = Path(__file__).absolute().parents[1]
+        model_cache_dir = root_project / 'model'
+        model_cache_dir.mkdir(parents=True, exist_ok=True)
+        os.environ["SENTENCE_TRANSFORMERS_HOME"] = str(model_cache_dir)
+        os.environ["TRANSFORMERS_CACHE"] = str(model_cache_dir)
+        try:
+            model = SentenceTransformer(
+                model_name,
+                cache_folder=str(model_cache_dir),
+                local_files_only=True,
+                **load_kwargs(backend))
+            logger.info("Модель загружена из локального кэша (backend: %s).", backend)
+        except OSError:
             try:
-                cls._instance = SentenceTransformer(
+                logger.info("Локально модель не найдена. Загрузка из Hugging Face...")
+                model = SentenceTransformer(
                     model_name,
                     cache_folder=str(model_cache_dir),
-                    local_files_only=True)
-                print("Модель загружена из локального кэша.")
-            except OSError:
-                try:
-                    print("Локально модель не найдена. Загрузка из Hugging Face...")
-                    cls._instance = SentenceTransformer(
-                        model_name,
-                        cache_folder=str(model_cache_dir),
-                        local_files_only=False,
-                    )
-                except Exception as e:
-                    print("Ошибка загрузки модели:", e)
-                    raise RuntimeError("Embedding model initialization failed")
-
-                print("Модель загружена и сохранена локально.")
+                    local_files_only=False,
+                    **load_kwargs(backend)
+                )
+            except Exception as e:
+                logger.error("Ошибка загрузки модели: %s", e)
+                raise RuntimeError("Embedding model initialization failed")
+
+            logger.info("Модель загружена и сохранена локально (backend: %s).", backend)
+        if backend == "int8":
+            quantize_int8(model)
+        return model
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    started = time.perf_counter()
+                    cls._instance = cls.load()
+                    cls.load_seconds = time.perf_counter() - started
+                    metrics.observe("rag_stage_seconds", cls.load_seconds, stage="load_embedder")
         return cls._instance
 
     @classmethod
-    def encode_query(cls, texts):
+    def is_loaded(cls):
+        return cls._instance is not None
+
+    # Векторы разных бэкендов немного различаются, поэтому кэшируются раздельно
+    @classmethod
+    def cache_model_name(cls):
+        return model_name if cls.backend == "torch" else f"{model_name}@{cls.backend}"
+
+    @classmethod
+    def get_cache(cls):
+        if cls._cache is None and EMBEDDING_CACHE_SIZE > 0:
+            dim = cls.get_instance().get_sentence_embedding_dimension()
+            with cls._lock:
+                if cls._cache is None:
+                    root_project = Path(__file__).absolute().parents[1]
+                    cache_dir = root_project / 'model' / 'embedding_cache' / cls.cache_model_name().replace("/", "__")
+                    cls._cache = EmbeddingCache(cache_dir, dim, EMBEDDING_CACHE_SIZE)
+        return cls._cache
+
+    # SentenceTransformer.encode сам сортирует тексты по длине перед нарезкой
+    # на батчи (меньше паддинга) и возвращает их в исходном порядке, поэтому
+    # отдельная токенизация ради сортировки не нужна
+    @classmethod
+    def encode_batched(cls, texts, batch_size=None):
         model = cls.get_instance()
-        texts = [f"query: {t}" for t in texts]
-        return model.encode(texts, normalize_embeddings=True)
+        if not texts:
+            return np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+        started = time.perf_counter()
+        result = model.encode(
+            texts,
+            batch_size=batch_size or cls.batch_size,
+            normalize_embeddings=True
+        ).astype(np.float32, copy=False)
+        with cls._stats_lock:
+            cls._encoded_texts += len(texts)
+            cls._encode_seconds += time.perf_counter() - started
+        return result
 
+    # Вход — готовые id токенов (с префиксом и спецтокенами), повторной
+    # токенизации нет; бакеты — по длине в токенах
     @classmethod
-    def encode_passages(cls, texts):
+    def encode_token_ids(cls, input_ids, batch_size=None):
+        import torch
         model = cls.get_instance()
-        texts = [f"passage: {t}" for t in texts]
-        return model.encode(texts, normalize_embeddings=True)
+        dim = model.get_sentence_embedding_dimension()
+        if not input_ids:
+            return np.empty((0, dim), dtype=np.float32)
+        batch_size = batch_size or cls.batch_size
+        started = time.perf_counter()
+        order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]))
+        result = np.empty((len(input_ids), dim), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            features = model.tokenizer.pad({"input_ids": [input_ids[i] for i in bucket]}, return_tensors="pt")
+            features = {name: tensor.to(model.device) for name, tensor in features.items()}
+            with torch.inference_mode():
+                embeddings = model(features)["sentence_embedding"]
+            result[bucket] = torch.nn.functional.normalize(embeddings, dim=1).float().cpu().numpy()
+        with cls._stats_lock:
+            cls._encoded_texts += len(input_ids)
+            cls._encode_seconds += time.perf_counter() - started
+        return result
+
+    @classmethod
+    def prefix_ids(cls, prefix):
+        ids = cls._prefix_ids.get(prefix)
+        if ids is None:
+            # Без завершающего пробела: SentencePiece превратил бы его в отдельный
+            # токен «▁», а в «passage: текст» пробел входит в первый токен текста
+            ids = cls._prefix_ids[prefix] = cls.get_instance().tokenizer(
+                f"{prefix}:", add_special_tokens=False
+            )["input_ids"]
+        return ids
+
+    # Сколько токенов текста помещается в модель вместе с префиксом и спецтокенами
+    @classmethod
+    def token_budget(cls, prefix="passage"):
+        return cls.get_instance().max_seq_length - 2 - len(cls.prefix_ids(prefix))
+
+    @classmethod
+    def input_ids(cls, token_ids, prefix="passage"):
+        tokenizer = cls.get_instance().tokenizer
+        return tokenizer.build_inputs_with_special_tokens(
+            cls.prefix_ids(prefix) + list(token_ids[:cls.token_budget(prefix)])
+        )
+
+    @classmethod
+    def throughput(cls):
+        with cls._stats_lock:
+            if not cls._encode_seconds:
+                return 0.0
+            return cls._encoded_texts / cls._encode_seconds
+
+    @classmethod
+    def reset_throughput(cls):
+        with cls._stats_lock:
+            cls._encoded_texts = 0
+            cls._encode_seconds = 0.0
+
+    # token_ids — id токенов каждого текста без префикса (их отдаёт чанкер);
+    # тогда тексты не токенизируются заново
+    @classmethod
+    def _encode_uncached(cls, texts, prefix, token_ids=None):
+        if token_ids is not None:
+            return cls.encode_token_ids([cls.input_ids(ids, prefix) for ids in token_ids])
+        return cls.encode_batched([f"{prefix}: {t}" for t in texts])
+
+    @classmethod
+    def _encode(cls, texts, prefix, token_ids=None):
+        texts = list(texts)
+        cache = cls.get_cache() if cls.use_cache else None
+        if cache is None:
+            return cls._encode_uncached(texts, prefix, token_ids)
+
+        keys = [EmbeddingCache.make_key(cls.cache_model_name(), prefix, t) for t in texts]
+        vectors = cache.get_many(keys)
+        missing = {key: i for i, key in enumerate(keys) if key not in vectors}
+        metrics.inc("rag_embedding_cache_total", len(keys) - len(missing), result="hit", prefix=prefix)
+        metrics.inc("rag_embedding_cache_total", len(missing), result="miss", prefix=prefix)
+        if missing:
+            encoded = cls._encode_uncached(
+                [texts[i] for i in missing.values()],
+                prefix,
+                None if token_ids is None else [token_ids[i] for i in missing.values()]
+            )
+            cache.put_many(list(missing), encoded)
+            vectors.update(zip(missing, encoded))
+        if not keys:
+            return np.empty((0, cache.dim), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys]).astype(np.float32, copy=False)
+
+    @classmethod
+    def encode_query(cls, texts):
+        return cls._encode(texts, "query")
+
+    @classmethod
+    def encode_passages(cls, texts, token_ids=None):
+        return cls._encode(texts, "passage", token_ids)
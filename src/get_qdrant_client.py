@@ -1,12 +1,106 @@
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 from pathlib import Path
+import os
+import threading
+import time
+
+# Адрес сервера Qdrant; без него используется локальная база в qdrant_db.
+# HNSW, квантизация и payload-индексы работают только на сервере —
+# локальный режим ищет полным перебором и принимает настройки без эффекта
+QDRANT_URL = os.getenv("QDRANT_URL")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "128"))
+# ef при поиске: больше — выше recall и задержка
+QDRANT_HNSW_EF = int(os.getenv("QDRANT_HNSW_EF", "128"))
+# INT8-квантизация векторов; исходные float32 остаются для пересчёта top-k
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "1") == "1"
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
+# Хранить исходные векторы на диске, в памяти — только квантизованные
+QDRANT_VECTORS_ON_DISK = os.getenv("QDRANT_VECTORS_ON_DISK", "0") == "1"
+
+# Поля payload, по которым фильтруется поиск
+PAYLOAD_INDEXES = {
+    "document": models.PayloadSchemaType.KEYWORD,
+    "doc_id": models.PayloadSchemaType.INTEGER,
+    "node_type": models.PayloadSchemaType.KEYWORD,
+}
+
+
+def collection_config(dim, hnsw_m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT,
+                      quantization=QDRANT_QUANTIZATION, on_disk=QDRANT_VECTORS_ON_DISK):
+    return {
+        "vectors_config": models.VectorParams(size=dim, distance=models.Distance.COSINE, on_disk=on_disk),
+        "hnsw_config": models.HnswConfigDiff(m=hnsw_m, ef_construct=ef_construct),
+        "quantization_config": models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True
+            )
+        ) if quantization else None,
+    }
+
+
+# exact — точный перебор по исходным float32: квантизованные векторы
+# игнорируются, даже если они есть в коллекции
+def search_params(hnsw_ef=QDRANT_HNSW_EF, quantization=QDRANT_QUANTIZATION,
+                  oversampling=QDRANT_OVERSAMPLING, rescore=True, exact=False):
+    if exact:
+        return models.SearchParams(exact=True, quantization=models.QuantizationSearchParams(ignore=True))
+    return models.SearchParams(
+        hnsw_ef=hnsw_ef,
+        exact=exact,
+        quantization=models.QuantizationSearchParams(
+            rescore=rescore,
+            oversampling=oversampling
+        ) if quantization else None
+    )
+
+
+def document_filter(documents):
+    if not documents:
+        return None
+    return models.Filter(must=[
+        models.FieldCondition(key="document", match=models.MatchAny(any=list(documents)))
+    ])
+
+
+def ensure_payload_indexes(client, collection_name):
+    if not QDRANT_URL:
+        return
+    existing = client.get_collection(collection_name).payload_schema or {}
+    for field, schema in PAYLOAD_INDEXES.items():
+        if field not in existing:
+            client.create_payload_index(collection_name, field_name=field, field_schema=schema, wait=True)
+
 
 class QdrantClientSingleton:
     _instance = None
+    _lock = threading.Lock()
+    load_seconds = None
 
     @classmethod
     def get_instance(cls):
         if cls._instance is None:
-            root_project = Path(__file__).absolute().parents[1]
-            cls._instance = QdrantClient(path=str(root_project / "qdrant_db"))
+            with cls._lock:
+                if cls._instance is None:
+                    started = time.perf_counter()
+                    if QDRANT_URL:
+                        cls._instance = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+                    else:
+                        root_project = Path(__file__).absolute().parents[1]
+                        cls._instance = QdrantClient(path=str(root_project / "qdrant_db"))
+                    cls.load_seconds = time.perf_counter() - started
         return cls._instance
+
+    @classmethod
+    def is_loaded(cls):
+        return cls._instance is not None
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.close()
+                cls._instance = None
@@ -1,37 +1,70 @@
-from sentence_transformers import CrossEncoder
+import logging
 import os
+import threading
+import time
 from pathlib import Path
+import metrics
+from backends import backend_from_env, load_kwargs, quantize_int8
 
 model_name = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
+RERANKER_BACKEND = backend_from_env("RERANKER_BACKEND")
+
+logger = logging.getLogger(__name__)
+
+
 class Reranker:
     _instance = None
+    _lock = threading.Lock()
+    load_seconds = None
+    backend = RERANKER_BACKEND
+
     @classmethod
-    def get_instance(cls):
-        if cls._instance is None:
-            root_project = Path(__file__).absolute().parents[1]
-            reranker_cache_dir = root_project / 'model'
-            reranker_cache_dir.mkdir(parents=True, exist_ok=True)
-            os.environ["SENTENCE_TRANSFORMERS_HOME"] = str(reranker_cache_dir)
-            os.environ["TRANSFORMERS_CACHE"] = str(reranker_cache_dir)
+    def load(cls, backend=None):
+        from sentence_transformers import CrossEncoder
+        backend = backend or cls.backend
+        root_project = Path(__file__).absolute().parents[1]
+        reranker_cache_dir = root_project / 'model'
+        reranker_cache_dir.mkdir(parents=True, exist_ok=True)
+        os.environ["SENTENCE_TRANSFORMERS_HOME"] = str(reranker_cache_dir)
+        os.environ["TRANSFORMERS_CACHE"] = str(reranker_cache_dir)
+        try:
+            reranker = CrossEncoder(
+                model_name,
+                cache_folder=str(root_project / 'model'),
+                local_files_only=True,
+                **load_kwargs(backend)
+            )
+            logger.info("Реранкер загружен из локального кэша (backend: %s).", backend)
+        except OSError:
             try:
-                cls._instance = CrossEncoder(
+                logger.info("Локально реранкер не найден. Загрузка...")
+                reranker = CrossEncoder(
                     model_name,
                     cache_folder=str(root_project / 'model'),
-                    local_files_only=True
+                    local_files_only=False,
+                    **load_kwargs(backend)
                 )
-                print("Реранкер загружен из локального кэша.")
-            except OSError:
-                try:
-                    print("Локально реранкер не найден. Загрузка...")
-                    cls._instance = CrossEncoder(
-                        model_name,
-                        cache_folder=str(root_project / 'model'),
-                        local_files_only=False
-                    )
-                except Exception as e:
-                    print("Не удалось загрузить реранкер:", e)
-                    raise RuntimeError("Reranker initialization failed")
-
-                print("Реранкер загружен и сохранен локально.")
-        return cls._instance
\ No newline at end of file
+            except Exception as e:
+                logger.error("Не удалось загрузить реранкер: %s", e)
+                raise RuntimeError("Reranker initialization failed")
+
+            logger.info("Реранкер загружен и сохранен локально (backend: %s).", backend)
+        if backend == "int8":
+            quantize_int8(reranker.model)
+        return reranker
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    started = time.perf_counter()
+                    cls._instance = cls.load()
+                    cls.load_seconds = time.perf_counter() - started
+                    metrics.observe("rag_stage_seconds", cls.load_seconds, stage="load_reranker")
+        return cls._instance
+
+    @classmethod
+    def is_loaded(cls):
+        return cls._instance is not None
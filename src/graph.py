@@ -1,96 +1,187 @@
+import argparse
 import time
-from neo4j import GraphDatabase
 from pathlib import Path
 from typing import List, Dict
-from neo4j.exceptions import ServiceUnavailable
 from get_qdrant_client import QdrantClientSingleton
-import re
+from get_graph_client import GraphClient, GraphClientSingleton
 import os
-from dotenv import load_dotenv
-from entity_rules import ENTITY_RULES
-
-load_dotenv()
-
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USER = os.getenv("NEO4J_USER")
-NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-
-class GraphClient:
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(
-            uri,
-            auth=(user, password),
-            max_connection_lifetime=300,
-            connection_timeout=30
-        )
+from entity_matcher import extract_entities
+from ingest_manifest import text_sha1
+import metrics
+
+# Сколько строк отправляется в одной транзакции UNWIND
+BATCH_SIZE = int(os.getenv("GRAPH_BATCH_SIZE", "1000"))
 
-    def close(self):
-        self.driver.close()
-
-    def run(self, query, **params):
-        for attempt in range(5):
-            try:
-                with self.driver.session() as session:
-                    return session.run(query, params)
-            except ServiceUnavailable as e:
-                print(f"Neo4j connection lost, retry {attempt + 1}/5...")
-                time.sleep(2)
-        raise RuntimeError("Neo4j connection failed after retries")
-
-def extract_entities(text: str):
-    text = text.lower()
-    found = []
-
-    for entity, patterns in ENTITY_RULES.items():
-        for pattern in patterns:
-            if re.search(pattern, text):
-                found.append(entity)
-                break
-
-    return list(set(found))
-
-def init_schema(graph: GraphClient):
-    graph.run("MATCH (n) DETACH DELETE n")
+def init_schema(graph: GraphClient, wipe: bool = False):
+    if wipe:
+        graph.run("MATCH (n) DETACH DELETE n")
     graph.run("CREATE CONSTRAINT IF NOT EXISTS FOR (d:Document) REQUIRE d.name IS UNIQUE")
     graph.run("CREATE CONSTRAINT IF NOT EXISTS FOR (c:Chunk) REQUIRE c.id IS UNIQUE")
     graph.run("CREATE CONSTRAINT IF NOT EXISTS FOR (e:Entity) REQUIRE e.name IS UNIQUE")
 
-def save_chunk(
-    graph: GraphClient,
-    doc_name: str,
-    chunk_id: str,
-    text: str,
-    entities: List[str]
-):
-    graph.run("""
-    MERGE (d:Document {name: $doc_name})
-    MERGE (c:Chunk {id: $chunk_id})
-    SET c.text = $text
-    MERGE (d)-[:HAS_CHUNK]->(c)
-    """, doc_name=doc_name, chunk_id=chunk_id, text=text)
-
-    for ent in entities:
-        graph.run("""
-        MERGE (e:Entity {name: $entity})
-        WITH e
-        MATCH (c:Chunk {id: $chunk_id})
-        MERGE (c)-[:MENTIONS]->(e)
-        """, entity=ent, chunk_id=chunk_id)
-
-def build_graph_from_chunks(chunks: List[Dict]):
-    graph = GraphClient(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
-    init_schema(graph)
-
+SAVE_ENTITIES_QUERY = """
+UNWIND $rows AS name
+MERGE (:Entity {name: name})
+"""
+
+SAVE_CHUNKS_QUERY = """
+UNWIND $rows AS row
+MERGE (d:Document {name: row.doc_name})
+MERGE (c:Chunk {id: row.chunk_id})
+SET c.text = row.text, c.hash = row.hash, c.point_id = row.point_id
+MERGE (d)-[:HAS_CHUNK]->(c)
+"""
+
+DETACH_CHUNKS_QUERY = """
+UNWIND $rows AS id
+MATCH (c:Chunk {id: id})-[r:MENTIONS|HAS_CHUNK]-()
+DELETE r
+"""
+
+DELETE_CHUNKS_QUERY = """
+UNWIND $rows AS id
+MATCH (c:Chunk {id: id})
+DETACH DELETE c
+"""
+
+DELETE_ORPHAN_ENTITIES_QUERY = """
+MATCH (e:Entity)
+WHERE NOT (e)<-[:MENTIONS]-()
+DELETE e
+RETURN count(e) AS removed
+"""
+
+DELETE_ORPHAN_DOCUMENTS_QUERY = """
+MATCH (d:Document)
+WHERE NOT (d)-[:HAS_CHUNK]->()
+DELETE d
+RETURN count(d) AS removed
+"""
+
+# IDF сущности по чанкам: редкие сущности весят больше при ранжировании
+COMPUTE_IDF_QUERY = """
+MATCH (c:Chunk)
+WITH count(c) AS total
+MATCH (e:Entity)
+OPTIONAL MATCH (e)<-[m:MENTIONS]-()
+WITH e, total, count(m) AS df
+SET e.df = df, e.idf = log((1.0 + total) / (1.0 + df)) + 1.0
+RETURN count(e) AS entities
+"""
+
+# id точки Qdrant для чанков, сохранённых до появления поля point_id
+SET_POINT_IDS_QUERY = """
+UNWIND $rows AS row
+MATCH (c:Chunk {id: row.chunk_id})
+SET c.point_id = row.point_id
+"""
+
+SAVE_MENTIONS_QUERY = """
+UNWIND $rows AS row
+MATCH (c:Chunk {id: row.chunk_id})
+MATCH (e:Entity {name: row.entity})
+MERGE (c)-[:MENTIONS]->(e)
+"""
+
+
+def chunk_key(chunk: Dict) -> str:
+    return f'{chunk["metadata"]["doc_id"]}_{chunk["metadata"]["chunk_id"]}'
+
+
+def chunk_rows(chunks: List[Dict]):
+    rows = []
     for chunk in chunks:
-        doc_name = chunk["metadata"]["document"]
-        chunk_id = f'{chunk["metadata"]["doc_id"]}_{chunk["metadata"]["chunk_id"]}'
-        text = chunk["text"]
-
-        entities = extract_entities(text)
-
-        save_chunk(graph, doc_name, chunk_id, text, entities)
+        rows.append({
+            "doc_name": chunk["metadata"]["document"],
+            "chunk_id": chunk_key(chunk),
+            "point_id": chunk["point_id"],
+            "text": chunk["text"],
+            "hash": chunk["metadata"]["text_hash"],
+            "entities": extract_entities(chunk["text"])
+        })
+    return rows
+
+
+def timed_batches(graph: GraphClient, label: str, query: str, rows: List, batch_size: int):
+    started = time.perf_counter()
+    with metrics.span("graph_write", part=label) as attrs:
+        attrs["rows"] = len(rows)
+        graph.run_batches(query, rows, batch_size)
+    elapsed = time.perf_counter() - started
+    rate = len(rows) / elapsed if elapsed else 0.0
+    print(f"  {label}: {len(rows)} строк за {elapsed:.2f} с ({rate:.0f} строк/с)")
+
+
+def save_chunks(graph: GraphClient, rows: List[Dict], batch_size: int = BATCH_SIZE):
+    entities = sorted({ent for row in rows for ent in row["entities"]})
+    mentions = [
+        {"chunk_id": row["chunk_id"], "entity": ent}
+        for row in rows for ent in row["entities"]
+    ]
+    chunks = [
+        {"doc_name": row["doc_name"], "chunk_id": row["chunk_id"], "point_id": row["point_id"],
+         "text": row["text"], "hash": row["hash"]}
+        for row in rows
+    ]
+    timed_batches(graph, "сущности", SAVE_ENTITIES_QUERY, entities, batch_size)
+    timed_batches(graph, "чанки и документы", SAVE_CHUNKS_QUERY, chunks, batch_size)
+    timed_batches(graph, "связи MENTIONS", SAVE_MENTIONS_QUERY, mentions, batch_size)
+
+
+def compute_entity_idf(graph: GraphClient):
+    entities = graph.run(COMPUTE_IDF_QUERY)[0]["entities"]
+    print(f"Пересчитан IDF для {entities} сущностей")
+
+
+def build_graph_from_chunks(chunks: List[Dict], batch_size: int = BATCH_SIZE):
+    graph = GraphClientSingleton.get_instance()
+    init_schema(graph, wipe=True)
+    save_chunks(graph, chunk_rows(chunks), batch_size)
+    compute_entity_idf(graph)
+
+
+# Инкрементальная синхронизация: граф не очищается, сравниваются id и хэши
+# текста чанков в Qdrant и в Neo4j, меняются только отличающиеся чанки
+def sync_graph_from_chunks(chunks: List[Dict], batch_size: int = BATCH_SIZE):
+    graph = GraphClientSingleton.get_instance()
+    init_schema(graph)
 
-    graph.close()
+    existing = {}
+    point_ids = {}
+    for r in graph.run("MATCH (c:Chunk) RETURN c.id AS id, c.hash AS hash, c.point_id AS point_id"):
+        existing[r["id"]] = r["hash"]
+        point_ids[r["id"]] = r["point_id"]
+    current = {chunk_key(chunk): chunk for chunk in chunks}
+
+    added = [chunk for key, chunk in current.items() if key not in existing]
+    changed = [
+        chunk for key, chunk in current.items()
+        if key in existing and existing[key] != chunk["metadata"]["text_hash"]
+    ]
+    removed = [key for key in existing if key not in current]
+    print(f"Новых чанков: {len(added)}, изменённых: {len(changed)}, удалённых: {len(removed)}, "
+          f"без изменений: {len(current) - len(added) - len(changed)}")
+
+    if changed:
+        timed_batches(graph, "старые связи изменённых чанков", DETACH_CHUNKS_QUERY,
+                      [chunk_key(chunk) for chunk in changed], batch_size)
+    if added or changed:
+        save_chunks(graph, chunk_rows(added + changed), batch_size)
+    relinked = [
+        {"chunk_id": key, "point_id": chunk["point_id"]}
+        for key, chunk in current.items()
+        if key in existing and existing[key] == chunk["metadata"]["text_hash"]
+        and point_ids[key] != chunk["point_id"]
+    ]
+    if relinked:
+        timed_batches(graph, "id точек Qdrant", SET_POINT_IDS_QUERY, relinked, batch_size)
+    if removed:
+        timed_batches(graph, "удалённые чанки", DELETE_CHUNKS_QUERY, removed, batch_size)
+
+    entities = graph.run(DELETE_ORPHAN_ENTITIES_QUERY)[0]["removed"]
+    documents = graph.run(DELETE_ORPHAN_DOCUMENTS_QUERY)[0]["removed"]
+    print(f"Удалено сущностей без связей: {entities}, документов без чанков: {documents}")
+    compute_entity_idf(graph)
 
 def load_chunks_from_qdrant(collection_name: str):
     root_project = Path(__file__).absolute().parents[1]
@@ -113,25 +204,39 @@ def load_chunks_from_qdrant(collection_name: str):
 
         for p in points:
             chunks.append({
+                "point_id": str(p.id),
                 "text": p.payload.get("text", ""),
                 "metadata": {
                     "document": p.payload.get("document"),
                     "doc_id": p.payload.get("doc_id"),
-                    "chunk_id": p.payload.get("chunk_id")
+                    "chunk_id": p.payload.get("chunk_id"),
+                    "text_hash": p.payload.get("text_hash") or text_sha1(p.payload.get("text", ""))
                 }
             })
 
         if offset is None:
             break
 
-    client.close()
+    QdrantClientSingleton.close()
     return chunks
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Построение графа знаний в Neo4j")
+    parser.add_argument("--full", action="store_true",
+                        help="очистить базу Neo4j и построить граф заново")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="сколько строк отправлять в одной транзакции UNWIND")
+    args = parser.parse_args()
+
     print("Построение графа знаний...")
 
     chunks = load_chunks_from_qdrant("collection_1")
     print(f"Загружено чанков из Qdrant: {len(chunks)}")
 
-    build_graph_from_chunks(chunks)
-    print("Граф построен.")
\ No newline at end of file
+    started = time.perf_counter()
+    if args.full:
+        build_graph_from_chunks(chunks, args.batch_size)
+    else:
+        sync_graph_from_chunks(chunks, args.batch_size)
+    GraphClientSingleton.close()
+    print(f"Граф построен за {time.perf_counter() - started:.1f} с.")
\ No newline at end of file
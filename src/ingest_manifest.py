@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+
+# Пространство имён для детерминированных id точек в Qdrant
+POINT_NAMESPACE = uuid.UUID("6f1c2b9e-4d0a-5e8b-9c3f-2a7d1e6b0c54")
+
+
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def text_sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def chunk_point_id(doc_name: str, chunk_id: int, text_hash: str) -> str:
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{doc_name}|{chunk_id}|{text_hash}"))
+
+
+class IngestManifest:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.documents = {}
+        self.next_doc_id = 0
+
+    @classmethod
+    def load(cls, path):
+        manifest = cls(path)
+        if manifest.path.exists():
+            with open(manifest.path, encoding="utf-8") as f:
+                data = json.load(f)
+            manifest.documents = data.get("documents", {})
+            manifest.next_doc_id = data.get("next_doc_id", 0)
+        return manifest
+
+    def save(self):
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"documents": self.documents, "next_doc_id": self.next_doc_id},
+                f, ensure_ascii=False, indent=2
+            )
+        os.replace(tmp_path, self.path)
+
+    # Версия корпуса: меняется при добавлении, изменении и удалении документов
+    def version(self) -> str:
+        h = hashlib.sha1()
+        for doc_name in sorted(self.documents):
+            h.update(f"{doc_name}\0{self.documents[doc_name]['hash']}\n".encode("utf-8"))
+        return h.hexdigest()
+
+    def reset(self):
+        self.documents = {}
+        self.next_doc_id = 0
+
+    def is_unchanged(self, doc_name: str, file_hash: str) -> bool:
+        entry = self.documents.get(doc_name)
+        return entry is not None and entry["hash"] == file_hash
+
+    def doc_id_for(self, doc_name: str) -> int:
+        entry = self.documents.get(doc_name)
+        if entry is not None:
+            return entry["doc_id"]
+        doc_id = self.next_doc_id
+        self.next_doc_id += 1
+        return doc_id
+
+    def point_ids(self, doc_name: str):
+        entry = self.documents.get(doc_name)
+        return set(entry["points"]) if entry else set()
+
+    def update(self, doc_name: str, file_hash: str, doc_id: int, point_ids):
+        self.documents[doc_name] = {
+            "hash": file_hash,
+            "doc_id": doc_id,
+            "points": list(point_ids)
+        }
+
+    def remove(self, doc_name: str):
+        self.documents.pop(doc_name, None)
@@ -0,0 +1,254 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS = os.getenv("METRICS", "1") == "1"
+# Порт отдельного HTTP-эндпоинта /metrics для консольных скриптов (0 — не поднимать)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Файл JSON-лога спанов (по строке на спан); пишут в него и процессы пула извлечения
+METRICS_LOG = os.getenv("METRICS_LOG")
+
+# Границы корзин: секунды для этапов, штуки/символы для размеров
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 2, 5, 10, 15, 20, 50, 100, 500, 1000, 1500, 3000, 10000)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    # Накопленное с прошлого вызова (и обнуление): процессы пула извлечения
+    # возвращают это вместе с результатом задачи, родитель добавляет через merge
+    def drain(self):
+        with self._lock:
+            state = {
+                "counters": dict(self._counters),
+                "histograms": {
+                    key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()
+                }
+            }
+            self._counters.clear()
+            self._histograms.clear()
+        return state
+
+    def merge(self, state):
+        with self._lock:
+            for key, value in state["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (buckets, counts, total, count) in state["histograms"].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(buckets)
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+
+    # Текстовый формат Prometheus (version 0.0.4)
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": {_key(name, labels): value for (name, labels), value in self._counters.items()},
+                "histograms": {
+                    _key(name, labels): {"count": h.count, "sum": h.sum}
+                    for (name, labels), h in self._histograms.items()
+                }
+            }
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _key(name, labels):
+    return name + _labels(labels)
+
+
+registry = Registry()
+_log_lock = threading.Lock()
+_server = None
+
+
+def inc(name, value=1, **labels):
+    if METRICS:
+        registry.inc(name, value, **labels)
+
+
+def observe(name, value, buckets=TIME_BUCKETS, **labels):
+    if METRICS:
+        registry.observe(name, value, buckets, **labels)
+
+
+def log_span(stage, seconds, labels, attrs, error=None):
+    record = {"ts": time.time(), "stage": stage, "seconds": round(seconds, 6), "pid": os.getpid(),
+              **labels, **attrs}
+    if error:
+        record["error"] = error
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _log_lock:
+        with open(METRICS_LOG, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+# Время этапа уходит в гистограмму rag_stage_seconds{stage=...}, ошибки — в счётчик.
+# В yield отдаётся словарь, куда этап может дописать атрибуты для JSON-лога
+@contextmanager
+def span(stage, **labels):
+    attrs = {}
+    if not METRICS:
+        yield attrs
+        return
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        registry.inc("rag_stage_errors_total", stage=stage, **labels)
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        registry.observe("rag_stage_seconds", seconds, stage=stage, **labels)
+        if METRICS_LOG:
+            log_span(stage, seconds, labels, attrs, error)
+
+
+# Суммарные интервалы, которые включают другие этапы словаря таймингов
+AGGREGATE_STAGES = ("retrieval", "total")
+
+
+# Тайминги, которые retrieve-функции уже собирают в словарь, разом
+# переносятся в гистограммы этапов. В гистограммы идут только отдельные
+# этапы, длительность спана — total, а без него сумма этапов
+def record_timings(timings, **labels):
+    if not METRICS:
+        return
+    stages = {stage: seconds for stage, seconds in timings.items() if stage not in AGGREGATE_STAGES}
+    for stage, seconds in stages.items():
+        registry.observe("rag_stage_seconds", seconds, stage=stage, **labels)
+    if METRICS_LOG:
+        log_span("retrieve", timings.get("total", sum(stages.values())), labels, {"stages": timings})
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Снимок в текстовом формате Prometheus для пакетных скриптов (textfile collector
+# node_exporter): файл заменяется целиком, чтобы сборщик не прочитал его наполовину
+def write_textfile(path):
+    if not METRICS or not path:
+        return None
+    path = os.fspath(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+    return path
+
+
+def serve(port=METRICS_PORT, host="0.0.0.0"):
+    global _server
+    if _server is None and port:
+        _server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Метрики: http://{host}:{port}/metrics")
+    return _server
+
+
+if __name__ == "__main__":
+    import argparse
+    from collections import defaultdict
+
+    parser = argparse.ArgumentParser(description="Сводка по JSON-логу спанов (METRICS_LOG)")
+    parser.add_argument("log", nargs="?", default=METRICS_LOG)
+    args = parser.parse_args()
+
+    if not args.log:
+        parser.error("укажите файл лога или переменную METRICS_LOG")
+    durations = defaultdict(list)
+    with open(args.log, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            durations[record["stage"]].append(record["seconds"])
+    print(f"{'этап':<20} {'n':>6} {'p50, мс':>9} {'p95, мс':>9} {'сумма, с':>9}")
+    for stage, values in sorted(durations.items()):
+        values.sort()
+        p50 = values[len(values) // 2]
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"{stage:<20} {len(values):>6} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {sum(values):>9.1f}")
@@ -0,0 +1,130 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from get_model import Model
+from get_reranker import Reranker
+
+# Сколько ждать попутные запросы перед прогоном модели
+MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "5"))
+# Лимит батча: для эмбеддера — число вопросов, для реранкера — число пар
+QUERY_BATCH_SIZE = int(os.getenv("MICRO_BATCH_QUERY_SIZE", "32"))
+RERANK_BATCH_PAIRS = int(os.getenv("MICRO_BATCH_RERANK_PAIRS", "128"))
+# Сколько вызывающий ждёт результат батча (с запасом на первую загрузку модели)
+RESULT_TIMEOUT = float(os.getenv("MICRO_BATCH_RESULT_TIMEOUT", "120"))
+
+_enabled = os.getenv("MICRO_BATCHING", "0") == "1"
+_lock = threading.Lock()
+_query_batcher = None
+_rerank_batcher = None
+
+
+class MicroBatcher:
+    def __init__(self, fn, max_batch_size, max_wait_ms=MAX_WAIT_MS, item_size=None, name="micro-batcher"):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.item_size = item_size or (lambda item: 1)
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = self.item_size(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += self.item_size(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.fn([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"{self._thread.name}: получено {len(results)} результатов на {len(batch)} запросов"
+                    )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+
+def _encode_queries(questions):
+    return list(Model.encode_query(questions))
+
+
+# Пары всех запросов склеиваются в один прогон, затем оценки режутся обратно
+def _rerank_many(pair_lists):
+    flat = [pair for pairs in pair_lists for pair in pairs]
+    scores = Reranker.get_instance().predict(flat)
+    if len(scores) != len(flat):
+        raise RuntimeError(f"Реранкер вернул {len(scores)} оценок на {len(flat)} пар")
+    results = []
+    offset = 0
+    for pairs in pair_lists:
+        results.append(scores[offset:offset + len(pairs)])
+        offset += len(pairs)
+    return results
+
+
+def enable(flag=True):
+    global _enabled
+    _enabled = flag
+
+
+def get_query_batcher():
+    global _query_batcher
+    with _lock:
+        if _query_batcher is None:
+            _query_batcher = MicroBatcher(_encode_queries, QUERY_BATCH_SIZE, name="query-batcher")
+        return _query_batcher
+
+
+def get_rerank_batcher():
+    global _rerank_batcher
+    with _lock:
+        if _rerank_batcher is None:
+            _rerank_batcher = MicroBatcher(
+                _rerank_many, RERANK_BATCH_PAIRS, item_size=len, name="rerank-batcher"
+            )
+        return _rerank_batcher
+
+
+def encode_query(question):
+    if not _enabled:
+        return Model.encode_query([question])[0]
+    return get_query_batcher().submit(question).result(timeout=RESULT_TIMEOUT)
+
+
+def rerank(pairs):
+    if not _enabled:
+        return Reranker.get_instance().predict(pairs)
+    if not pairs:
+        return []
+    return get_rerank_batcher().submit(pairs).result(timeout=RESULT_TIMEOUT)
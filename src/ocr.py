@@ -0,0 +1,153 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+import metrics
+
+root_project = Path(__file__).absolute().parents[1]
+
+# dots — удалённый dots.ocr через Replicate, stub — локальная заглушка без сети
+OCR_BACKEND = os.getenv("OCR_BACKEND", "dots")
+# Одновременных запросов к OCR на один процесс извлечения
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "8"))
+# Сколько ждать распознавания одной страницы; недождавшиеся ячейки остаются как есть
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "120"))
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", str(root_project / "model" / "ocr_cache.sqlite"))
+
+
+class DotsOcrBackend:
+    name = "dots-ocr-1.5"
+
+    def recognize(self, png: bytes) -> str:
+        import replicate
+        output = replicate.run(
+            "rednote-ai/dots-ocr:dots-ocr-1.5",
+            input={
+                "image": png,
+                "prompt_mode": "prompt_layout_all_en"
+            }
+        )
+        if isinstance(output, str):
+            return output
+        else:
+            return ' '.join(output)
+
+
+# Ничего не распознаёт: ячейки остаются с текстом из PDF. Для тестов и
+# прогонов без сети; число вызовов видно в calls
+class StubOcrBackend:
+    name = "stub"
+
+    def __init__(self, text=""):
+        self.text = text
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def recognize(self, png: bytes) -> str:
+        with self._lock:
+            self.calls += 1
+        return self.text
+
+
+BACKENDS = {
+    "dots": DotsOcrBackend,
+    "stub": StubOcrBackend,
+}
+
+
+def image_png(image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def image_key(backend_name: str, png: bytes) -> str:
+    return hashlib.sha256(backend_name.encode("utf-8") + b"\0" + png).hexdigest()
+
+
+# Результаты OCR по хэшу картинки ячейки; база общая для всех процессов пула,
+# поэтому повторная индексация документа не распознаёт ячейки заново
+class OcrCache:
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT)")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT key, text FROM ocr WHERE key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall()
+        return dict(rows)
+
+    def put(self, key, text):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO ocr (key, text) VALUES (?, ?)", (key, text))
+            self._db.commit()
+
+
+class OcrStage:
+    def __init__(self, backend, cache=None, workers=OCR_WORKERS, timeout=OCR_TIMEOUT):
+        self.backend = backend
+        self.cache = cache
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr")
+
+    def _recognize(self, key, png):
+        metrics.inc("rag_ocr_calls_total", backend=self.backend.name)
+        with metrics.span("ocr", backend=self.backend.name) as attrs:
+            attrs["image_bytes"] = len(png)
+            text = self.backend.recognize(png)
+        if self.cache is not None:
+            self.cache.put(key, text)
+        return text
+
+    # Картинки дедуплицируются по хэшу, найденные в кэше не отправляются,
+    # остальные распознаются параллельно. Ошибка или таймаут дают None —
+    # вызывающий оставляет исходный текст ячейки. Ошибки не кэшируются, а
+    # запоздавший ответ всё равно ляжет в кэш и пригодится при следующей индексации
+    def recognize_many(self, images):
+        keys = [image_key(self.backend.name, png) for png in images]
+        unique = dict(zip(keys, images))
+        found = self.cache.get_many(unique) if self.cache is not None else {}
+        metrics.inc("rag_ocr_cache_total", len(found), result="hit")
+        metrics.inc("rag_ocr_cache_total", len(unique) - len(found), result="miss")
+
+        futures = {
+            key: self._pool.submit(self._recognize, key, png)
+            for key, png in unique.items() if key not in found
+        }
+        wait(futures.values(), timeout=self.timeout)
+        for key, future in futures.items():
+            if not future.done():
+                print(f"OCR не уложился в {self.timeout:g} с, ячейка оставлена без распознавания")
+                continue
+            if future.exception() is not None:
+                print(f"OCR failed: {future.exception()}")
+                continue
+            found[key] = future.result()
+        return [found.get(key) for key in keys]
+
+
+_lock = threading.Lock()
+_stage = None
+
+
+# Своя стадия в каждом процессе пула извлечения
+def get_stage():
+    global _stage
+    with _lock:
+        if _stage is None:
+            if OCR_BACKEND not in BACKENDS:
+                raise ValueError(f"OCR_BACKEND={OCR_BACKEND}: ожидается одно из {', '.join(BACKENDS)}")
+            _stage = OcrStage(BACKENDS[OCR_BACKEND](), OcrCache(OCR_CACHE_PATH))
+        return _stage
@@ -0,0 +1,43 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+
+# Строки страницы, не попадающие целиком ни в одну таблицу. Таблицы
+# отсортированы по top, reach[i] — максимальный bottom среди первых i+1 таблиц:
+# для строки проверяются только таблицы, начинающиеся не ниже её top,
+# и перебор останавливается, как только ни одна из них не дотягивает до её bottom
+def lines_outside_tables(lines, table_bboxes):
+    if not lines or not table_bboxes:
+        return list(lines)
+    if len(table_bboxes) == 1:
+        tx0, ty0, tx1, ty1 = table_bboxes[0]
+        return [line for line in lines
+                if not (line['x0'] >= tx0 and line['x1'] <= tx1 and
+                        line['top'] >= ty0 and line['bottom'] <= ty1)]
+    boxes = sorted(table_bboxes, key=lambda b: b[1])
+    tops = [b[1] for b in boxes]
+    reach = list(accumulate((b[3] for b in boxes), max))
+    outside = []
+    for line in lines:
+        bottom = line['bottom']
+        i = bisect_right(tops, line['top']) - 1
+        inside = False
+        while i >= 0 and reach[i] >= bottom:
+            tx0, _, tx1, ty1 = boxes[i]
+            if bottom <= ty1 and line['x0'] >= tx0 and line['x1'] <= tx1:
+                inside = True
+                break
+            i -= 1
+        if not inside:
+            outside.append(line)
+    return outside
+
+
+# Текст страницы по вертикали: строки вне таблиц по top, строки таблиц —
+# от верхней границы таблицы с шагом 0.1
+def assemble_page(lines, table_bboxes, tables_rows):
+    items = [(line['top'], line['text']) for line in lines_outside_tables(lines, table_bboxes)]
+    for y0, rows_text in tables_rows:
+        items.extend((y0 + idx * 0.1, row_text) for idx, row_text in enumerate(rows_text))
+    items.sort(key=lambda x: x[0])
+    return '\n'.join(text for _, text in items)
@@ -0,0 +1,222 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from functools import lru_cache
+from pathlib import Path
+from markitdown import MarkItDown
+from pypdf import PdfReader
+import pdfplumber
+import os
+import time
+import pymorphy3
+import metrics
+import ocr
+from page_layout import assemble_page
+import re
+
+# Крупные PDF режутся на задачи по столько страниц
+PAGES_PER_TASK = 16
+
+#решение для узких ячеек таблиц
+# Анализатор один на процесс: загрузка словарей pymorphy3 дорогая
+_morph = None
+
+
+def get_morph():
+    global _morph
+    if _morph is None:
+        _morph = pymorphy3.MorphAnalyzer()
+    return _morph
+
+
+@lru_cache(maxsize=100_000)
+def is_known_word(word: str) -> bool:
+    return get_morph().word_is_known(word)
+
+
+def _merge_words(words, is_known):
+    merged = []
+    i = 0
+    while i < len(words):
+        if i + 1 < len(words):
+            candidate = words[i] + words[i + 1]
+            if is_known(candidate):
+                merged.append(candidate)
+                i += 2
+                continue
+        merged.append(words[i])
+        i += 1
+    return ' '.join(merged)
+
+
+def merge_split_words(text: str) -> str:
+    words = text.split()
+    if len(words) < 2:
+        return text
+    return _merge_words(words, is_known_word)
+
+
+# Пакетная склейка для целой таблицы: все кандидаты на склейку
+# проверяются по словарю один раз, затем строки собираются по готовому набору
+def merge_split_words_table(rows):
+    rows_words = [row.split() for row in rows]
+    candidates = {a + b for words in rows_words for a, b in zip(words, words[1:])}
+    known = {candidate for candidate in candidates if is_known_word(candidate)}
+    return [
+        _merge_words(words, known.__contains__) if len(words) >= 2 else row
+        for row, words in zip(rows, rows_words)
+    ]
+
+# Узкие ячейки без пробелов длиннее 15 символов — обычно слова, склеенные
+# pdfplumber; их картинки отправляются на OCR
+def is_ocr_candidate(cell_clean: str) -> bool:
+    return ' ' not in cell_clean and len(cell_clean) > 15
+
+
+def valid_bbox(bbox):
+    return (isinstance(bbox, (list, tuple)) and len(bbox) == 4
+            and all(isinstance(v, (int, float)) for v in bbox))
+
+
+#извлечение текста
+def process_page(page):
+    lines = page.extract_text_lines()
+    tables = page.find_tables()
+    table_bboxes = [t.bbox for t in tables]
+
+    if not tables:
+        return page.extract_text()
+
+    # Сначала текст всех таблиц страницы и картинки ячеек-кандидатов,
+    # затем одно пакетное распознавание на страницу
+    tables_cells = []
+    ocr_cells = []
+    ocr_images = []
+    for t in tables:
+        cells = t.extract()
+        if not cells:
+            continue
+        rows_parts = []
+        for i, row in enumerate(cells):
+            row_bboxes = t.rows[i].cells if i < len(t.rows) else []
+            row_parts = []
+            for j, cell in enumerate(row):
+                if cell is None:
+                    row_parts.append('')
+                    continue
+                cell_clean = ' '.join(cell.split())
+                bbox = row_bboxes[j] if j < len(row_bboxes) else None
+                if is_ocr_candidate(cell_clean) and valid_bbox(bbox):
+                    try:
+                        cell_img = page.within_bbox(bbox).to_image(resolution=150).original
+                        ocr_images.append(ocr.image_png(cell_img))
+                        ocr_cells.append((len(tables_cells), i, j))
+                    except Exception as e:
+                        print(f"OCR failed for cell ({i},{j}): {e}")
+                row_parts.append(cell_clean)
+            rows_parts.append(row_parts)
+        tables_cells.append((t, rows_parts))
+
+    if ocr_images:
+        for (t_idx, i, j), ocr_text in zip(ocr_cells, ocr.get_stage().recognize_many(ocr_images)):
+            if ocr_text:
+                tables_cells[t_idx][1][i][j] = ' '.join(ocr_text.split())
+
+    tables_rows = []
+    for t, rows_parts in tables_cells:
+        rows_text = [' '.join(parts).strip() for parts in rows_parts]
+        tables_rows.append((t.bbox[1], merge_split_words_table([row for row in rows_text if row])))
+    return assemble_page(lines, table_bboxes, tables_rows)
+
+
+def join_pages(pages_text):
+    text = '\n'.join(t for t in pages_text if t)
+    return re.sub(r"([А-Яа-яЁёA-Za-z])\-\s*\n\s*([А-Яа-яЁёA-Za-z])", r"\1\2", text)
+
+
+# Возвращает текст страниц, время работы задачи в процессе пула (без
+# ожидания в очереди), процессорное время этого процесса и метрики,
+# накопленные в процессе (OCR и др.) — их реестр живёт только в процессе пула
+def extract_pages(path, start=0, end=None):
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    if Path(path).suffix.lower() != ".pdf":
+        pages_text = [MarkItDown().convert(str(path)).text_content]
+    else:
+        pages_text = []
+        with pdfplumber.open(path) as pdf:
+            for page in pdf.pages[start:end]:
+                pages_text.append(process_page(page))
+    work_time = time.perf_counter() - started
+    return pages_text, work_time, time.process_time() - cpu_started, metrics.registry.drain()
+
+
+def page_ranges(path, pages_per_task=PAGES_PER_TASK):
+    if Path(path).suffix.lower() != ".pdf":
+        return [(0, None)]
+    n_pages = len(PdfReader(str(path)).pages)
+    return [(start, min(start + pages_per_task, n_pages))
+            for start in range(0, max(n_pages, 1), pages_per_task)]
+
+
+# Параллельное извлечение: документы и диапазоны страниц раздаются пулу процессов,
+# результаты отдаются по мере готовности документа, страницы склеиваются по порядку.
+# В работе одновременно не больше max_in_flight задач, чтобы память не росла
+# вместе с корпусом, пока потребитель занят эмбеддингами.
+def extract_documents(paths, max_workers=None, pages_per_task=PAGES_PER_TASK, max_in_flight=None):
+    max_workers = max_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or max_workers * 2
+    paths = iter(paths)
+    queued = deque()
+    futures = {}
+    pending = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            while len(futures) < max_in_flight:
+                if not queued:
+                    path = next(paths, None)
+                    if path is None:
+                        break
+                    started = time.perf_counter()
+                    try:
+                        ranges = page_ranges(path, pages_per_task)
+                    except Exception as e:
+                        yield {"source": path, "content": None, "pages": 0,
+                               "elapsed": time.perf_counter() - started, "work_time": 0.0, "cpu_time": 0.0,
+                               "error": f"{type(e).__name__}: {e}"}
+                        continue
+                    pending[path] = {"parts": [None] * len(ranges), "left": len(ranges),
+                                     "started": started, "work_time": 0.0, "cpu_time": 0.0, "error": None}
+                    queued.extend((path, idx, start, end) for idx, (start, end) in enumerate(ranges))
+                path, idx, start, end = queued.popleft()
+                futures[pool.submit(extract_pages, path, start, end)] = (path, idx)
+
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, idx = futures.pop(future)
+                state = pending[path]
+                try:
+                    pages_text, work_time, cpu_time, worker_metrics = future.result()
+                    metrics.registry.merge(worker_metrics)
+                    state["parts"][idx] = pages_text
+                    state["work_time"] += work_time
+                    state["cpu_time"] += cpu_time
+                except Exception as e:
+                    state["error"] = state["error"] or f"{type(e).__name__}: {e}"
+                state["left"] -= 1
+                if state["left"]:
+                    continue
+
+                del pending[path]
+                pages_text = [t for part in state["parts"] if part for t in part]
+                yield {
+                    "source": path,
+                    "content": None if state["error"] else join_pages(pages_text),
+                    "pages": len(pages_text),
+                    "elapsed": time.perf_counter() - state["started"],
+                    "work_time": state["work_time"],
+                    "cpu_time": state["cpu_time"],
+                    "error": state["error"]
+                }
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+import metrics
+import micro_batcher
+
+# Размер LRU-кэша оценок (вопрос, чанк) → score
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+# Если первый кандидат опережает второй по similarity на столько, реранкер не нужен
+RERANK_SKIP_MARGIN = float(os.getenv("RERANK_SKIP_MARGIN", "0.05"))
+# В реранкер идут только кандидаты не дальше этого окна от лучшего similarity
+RERANK_WINDOW = float(os.getenv("RERANK_WINDOW", "0.05"))
+
+# Счётчики обновляются из потоков сервиса и микробатчера — только через count()
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def count(**increments):
+    with _stats_lock:
+        stats.update(increments)
+
+
+def stats_snapshot():
+    with _stats_lock:
+        return dict(stats)
+
+
+class RerankCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def put(self, key, score):
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+
+
+cache = RerankCache(RERANK_CACHE_SIZE)
+
+
+# Близкие по написанию вопросы (регистр, пунктуация, пробелы) дают один ключ
+def question_hash(question: str) -> str:
+    normalized = " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+# id точки Qdrant включает хэш текста чанка, поэтому после переиндексации
+# изменённого чанка старая оценка не подхватывается; без id — хэш текста
+def _cache_key(q_hash, candidate):
+    return q_hash, candidate.get("point_id") or hashlib.sha1(candidate["text"].encode("utf-8")).hexdigest()
+
+
+def predict_scores(question, candidates):
+    q_hash = question_hash(question)
+    keys = [_cache_key(q_hash, c) for c in candidates]
+    scores = [cache.get(key) for key in keys]
+    missing = [i for i, score in enumerate(scores) if score is None]
+    count(cache_hits=len(candidates) - len(missing), cache_misses=len(missing))
+    metrics.inc("rag_rerank_cache_total", len(candidates) - len(missing), result="hit")
+    metrics.inc("rag_rerank_cache_total", len(missing), result="miss")
+    if missing:
+        with metrics.span("rerank_model") as attrs:
+            attrs["pairs"] = len(missing)
+            predicted = micro_batcher.rerank([(question, candidates[i]["text"]) for i in missing])
+        metrics.observe("rag_rerank_pairs", len(missing), metrics.SIZE_BUCKETS)
+        for i, score in zip(missing, predicted):
+            scores[i] = float(score)
+            cache.put(keys[i], scores[i])
+    return scores
+
+
+# Каскад: при явном лидере по similarity реранкер пропускается,
+# иначе в него идут только кандидаты в окне от лучшего (не меньше final_k)
+def cascade(candidates, final_k=5, skip_margin=RERANK_SKIP_MARGIN, window=RERANK_WINDOW):
+    ordered = sorted(candidates, key=lambda c: c["similarity"], reverse=True)
+    if len(ordered) < 2:
+        return ordered, True
+    if ordered[0]["similarity"] - ordered[1]["similarity"] >= skip_margin:
+        count(skipped=1)
+        metrics.inc("rag_rerank_cascade_total", decision="skip")
+        return ordered, True
+    best = ordered[0]["similarity"]
+    shortlist = [c for c in ordered if best - c["similarity"] <= window]
+    if len(shortlist) < final_k:
+        shortlist = ordered[:final_k]
+    count(pairs_saved=len(ordered) - len(shortlist))
+    metrics.inc("rag_rerank_cascade_total", decision="shrink" if len(shortlist) < len(ordered) else "full")
+    return shortlist, False
+
+
+# Общий этап реранкинга для всех режимов поиска: кандидаты — словари
+# с полями text и metadata (и любыми дополнительными), к ним добавляется score
+def rerank_candidates(question, candidates, final_k=5):
+    if not candidates:
+        return "", []
+
+    scores = predict_scores(question, candidates)
+
+    ranked = sorted(
+        zip(candidates, scores),
+        key=lambda x: x[1],
+        reverse=True
+    )[:final_k]
+
+    final_chunks = [
+        {**candidate, "score": float(score), "reranked": True} for candidate, score in ranked
+    ]
+    context = "\n\n---SECTION---\n\n".join(c["text"] for c in final_chunks)
+
+    return context, final_chunks
+
+
+# Без реранкера порядок задаёт similarity, её же показываем как score
+def rank_by_similarity(candidates, final_k=5):
+    final_chunks = [
+        {**c, "score": c["similarity"], "reranked": False}
+        for c in sorted(candidates, key=lambda c: c["similarity"], reverse=True)[:final_k]
+    ]
+    context = "\n\n---SECTION---\n\n".join(c["text"] for c in final_chunks)
+    return context, final_chunks
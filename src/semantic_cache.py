@@ -0,0 +1,303 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from pathlib import Path
+import metrics
+import micro_batcher
+from get_qdrant_client import QdrantClientSingleton
+from ingest_manifest import IngestManifest
+from streaming import done_event
+
+root_project = Path(__file__).absolute().parents[1]
+collection_name = "collection_1"
+manifest_path = root_project / "ingest_manifest.json"
+
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "1") == "1"
+SEMANTIC_CACHE_PATH = os.getenv(
+    "SEMANTIC_CACHE_PATH", str(root_project / "model" / "semantic_cache.sqlite")
+)
+# Косинус между эмбеддингами вопросов, начиная с которого вопросы считаются одинаковыми
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600)))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "5000"))
+
+_lock = threading.Lock()
+_cache = None
+_version = (None, None)
+
+
+# id точек Qdrant, из которых собран ответ. В id входит хэш текста чанка,
+# поэтому после переиндексации изменённого документа старые id пропадают.
+# None — если хотя бы у одного чанка id неизвестен (граф, построенный до
+# появления point_id): такой ответ нельзя проверить и он не кэшируется
+def chunk_point_ids(chunks):
+    ids = [chunk.get("point_id") for chunk in chunks]
+    if not ids or not all(ids):
+        return None
+    return sorted(set(ids))
+
+
+def points_exist(point_ids):
+    if not point_ids:
+        return False
+    found = QdrantClientSingleton.get_instance().retrieve(
+        collection_name=collection_name,
+        ids=point_ids,
+        with_payload=False,
+        with_vectors=False
+    )
+    return len(found) == len(point_ids)
+
+
+# Версия корпуса из манифеста индексации; манифест перечитывается только
+# после изменения файла. Любое добавление, изменение или удаление документа
+# меняет версию, и все ответы, собранные по прежнему корпусу, удаляются —
+# новый документ мог бы изменить набор найденных чанков
+def corpus_version(path=manifest_path):
+    global _version
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return ""
+    with _lock:
+        if _version[0] != mtime:
+            _version = (mtime, IngestManifest.load(path).version())
+        return _version[1]
+
+
+class SemanticCache:
+    def __init__(self, path, threshold, ttl, max_entries, validate=points_exist, version=corpus_version):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.validate = validate
+        self.version = version
+        self._current_version = None
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._lock = threading.Lock()
+        self._index = None
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY, mode TEXT, question TEXT, embedding BLOB, "
+            "point_ids TEXT, answer TEXT, sources TEXT, created REAL, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(answers)")}
+        if "corpus_version" not in columns:
+            self._db.execute("ALTER TABLE answers ADD COLUMN corpus_version TEXT")
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    # Эмбеддинги всех записей держатся в памяти одной матрицей и
+    # перечитываются из базы только после изменений
+    def _load_index(self):
+        if self._index is None:
+            rows = self._db.execute("SELECT id, mode, embedding, created FROM answers").fetchall()
+            if rows:
+                self._index = (
+                    np.array([r[0] for r in rows]),
+                    np.array([r[1] for r in rows]),
+                    np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows]),
+                    np.array([r[3] for r in rows])
+                )
+            else:
+                self._index = (np.array([]), np.array([]), np.empty((0, 0), np.float32), np.array([]))
+        return self._index
+
+    def _find(self, mode, embedding):
+        ids, modes, matrix, created = self._load_index()
+        if not len(ids):
+            return None
+        similarities = matrix @ embedding
+        similarities[(modes != mode) | (created < time.time() - self.ttl)] = -1.0
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return int(ids[best]), float(similarities[best])
+
+    # Вызывается под self._lock
+    def _sync_version(self):
+        version = self.version()
+        if version != self._current_version:
+            removed = self._db.execute(
+                "DELETE FROM answers WHERE corpus_version IS NOT ?", (version,)
+            ).rowcount
+            self._db.commit()
+            self._current_version = version
+            if removed:
+                self._index = None
+                self.stale += removed
+                metrics.inc("rag_semantic_cache_total", removed, result="stale")
+        return version
+
+    def lookup(self, mode, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._sync_version()
+            found = self._find(mode, embedding)
+            if found is None:
+                self.misses += 1
+                metrics.inc("rag_semantic_cache_total", result="miss")
+                return None
+            entry_id, similarity = found
+            question, point_ids, answer, sources = self._db.execute(
+                "SELECT question, point_ids, answer, sources FROM answers WHERE id = ?", (entry_id,)
+            ).fetchone()
+
+        if not self.validate(json.loads(point_ids)):
+            with self._lock:
+                self._db.execute("DELETE FROM answers WHERE id = ?", (entry_id,))
+                self._db.commit()
+                self._index = None
+                self.stale += 1
+                self.misses += 1
+            metrics.inc("rag_semantic_cache_total", result="stale")
+            return None
+
+        with self._lock:
+            self._db.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), entry_id))
+            self._db.commit()
+            self.hits += 1
+        metrics.inc("rag_semantic_cache_total", result="hit")
+        return {
+            "question": question,
+            "similarity": similarity,
+            "answer": answer,
+            "sources": json.loads(sources)
+        }
+
+    # Ответы без источников или с чанками без id точки не сохраняются
+    def store(self, mode, question, embedding, answer, chunks):
+        point_ids = chunk_point_ids(chunks)
+        if not answer or point_ids is None:
+            return False
+        now = time.time()
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            version = self._sync_version()
+            self._db.execute(
+                "INSERT INTO answers (mode, question, embedding, point_ids, answer, sources, created, last_used, "
+                "corpus_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (mode, question, embedding.tobytes(), json.dumps(point_ids),
+                 answer, json.dumps(chunks, ensure_ascii=False), now, now, version)
+            )
+            self._evict(now)
+            self._db.commit()
+            self._index = None
+        return True
+
+    # Сначала удаляются просроченные записи, затем давно не использованные сверх лимита
+    def _evict(self, now):
+        self._db.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM answers WHERE id IN ("
+            "SELECT id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM answers")
+            self._db.commit()
+            self._index = None
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hit_rate()
+        }
+
+
+def get_cache():
+    global _cache
+    if not SEMANTIC_CACHE:
+        return None
+    with _lock:
+        if _cache is None:
+            _cache = SemanticCache(
+                SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_SIZE
+            )
+        return _cache
+
+
+# compute() выполняет поиск и генерацию и возвращает (answer, chunks).
+# Эмбеддинг вопроса берётся из кэша эмбеддингов, поэтому при промахе
+# повторное кодирование в retrieve почти ничего не стоит
+def cached_answer(mode, question, compute):
+    cache = get_cache()
+    if cache is None:
+        return compute()
+    embedding = micro_batcher.encode_query(question)
+    hit = cache.lookup(mode, embedding)
+    if hit is not None:
+        return hit["answer"], hit["sources"]
+    answer, chunks = compute()
+    cache.store(mode, question, embedding, answer, chunks)
+    return answer, chunks
+
+
+# События потокового ответа из кэша: источники, весь ответ одним токеном, done.
+# Общие для консольных скриптов и сервиса
+def hit_events(hit, started):
+    lookup_time = time.perf_counter() - started
+    return [
+        {"type": "sources", "sources": hit["sources"], "retrieval_time": lookup_time, "cached": True},
+        {"type": "token", "text": hit["answer"]},
+        done_event(started, lookup_time, time.perf_counter(), 0.0, cached=True)
+    ]
+
+
+# Потоковый вариант: при попадании источники и ответ отдаются сразу,
+# при промахе токены собираются и ответ сохраняется после генерации
+def cached_stream(mode, question, events):
+    cache = get_cache()
+    if cache is None:
+        yield from events(question)
+        return
+    started = time.perf_counter()
+    embedding = micro_batcher.encode_query(question)
+    hit = cache.lookup(mode, embedding)
+    if hit is not None:
+        yield from hit_events(hit, started)
+        return
+
+    chunks = []
+    tokens = []
+    for event in events(question):
+        if event["type"] == "sources":
+            chunks = event["sources"]
+        elif event["type"] == "token":
+            tokens.append(event["text"])
+        yield event
+    cache.store(mode, question, embedding, "".join(tokens), chunks)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Статистика и очистка семантического кэша ответов")
+    parser.add_argument("--clear", action="store_true", help="удалить все сохранённые ответы")
+    args = parser.parse_args()
+
+    cache = SemanticCache(SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_SIZE)
+    if args.clear:
+        cache.clear()
+        print("Семантический кэш очищен")
+    print(f"Записей в кэше: {len(cache)} (лимит {SEMANTIC_CACHE_SIZE}, TTL {SEMANTIC_CACHE_TTL / 3600:.0f} ч)")
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from aiohttp import web
+import get_answer
+import get_answer_graph
+import get_answer_hybrid
+import metrics
+import micro_batcher
+import reranking
+import semantic_cache
+import warmup
+import get_graph_client
+from get_graph_client import GraphClientSingleton
+from get_qdrant_client import QdrantClientSingleton
+from streaming import done_event
+
+HOST = os.getenv("SERVICE_HOST", "0.0.0.0")
+PORT = int(os.getenv("SERVICE_PORT", "8080"))
+# Сколько вопросов обрабатывается одновременно, остальные ждут в очереди
+MAX_CONCURRENT_REQUESTS = int(os.getenv("SERVICE_MAX_CONCURRENT_REQUESTS", "16"))
+# Потоки для блокирующих вызовов эмбеддера, Qdrant, Neo4j и реранкера;
+# при микробатчинге потоки в основном ждут общий прогон модели
+RETRIEVAL_WORKERS = int(os.getenv("SERVICE_RETRIEVAL_WORKERS", "16"))
+# Сколько запросов к Ollama держать в работе одновременно
+LLM_CONCURRENCY = int(os.getenv("SERVICE_LLM_CONCURRENCY", "4"))
+# Объединять одновременные вопросы в общий прогон эмбеддера и реранкера
+MICRO_BATCHING = os.getenv("SERVICE_MICRO_BATCHING", "1") == "1"
+
+
+def retrieve_vector(question):
+    return get_answer.retrieve_context(question, n_results=5)
+
+
+def retrieve_graph(question):
+    return get_answer_graph.retrieve_context_from_graph(question)
+
+
+def retrieve_hybrid(question):
+    return get_answer_hybrid.retrieve_context_hybrid(question)
+
+
+json_dumps = partial(json.dumps, ensure_ascii=False)
+
+EXECUTOR = web.AppKey("executor", ThreadPoolExecutor)
+REQUEST_SLOTS = web.AppKey("request_slots", asyncio.Semaphore)
+LLM_SLOTS = web.AppKey("llm_slots", asyncio.Semaphore)
+
+PIPELINES = {
+    "vector": (retrieve_vector, get_answer.aget_llm_answer, get_answer.astream_llm_answer),
+    "graph": (retrieve_graph, get_answer_graph.aget_llm_answer, get_answer_graph.astream_llm_answer),
+    "hybrid": (retrieve_hybrid, get_answer_hybrid.aget_llm_answer, get_answer_hybrid.astream_llm_answer),
+}
+
+
+# Эмбеддинг вопроса и поиск похожего ответа в семантическом кэше
+def lookup_cached(question, mode):
+    cache = semantic_cache.get_cache()
+    if cache is None:
+        return None, None
+    embedding = micro_batcher.encode_query(question)
+    return embedding, cache.lookup(mode, embedding)
+
+
+def store_cached(question, mode, embedding, answer, chunks):
+    cache = semantic_cache.get_cache()
+    if cache is not None:
+        cache.store(mode, question, embedding, answer, chunks)
+
+
+async def answer_question(app, question, mode):
+    retrieve, aget_llm_answer, _ = PIPELINES[mode]
+    loop = asyncio.get_running_loop()
+    timings = {}
+    async with app[REQUEST_SLOTS]:
+        started = time.perf_counter()
+        embedding, hit = await loop.run_in_executor(app[EXECUTOR], lookup_cached, question, mode)
+        timings["cache"] = time.perf_counter() - started
+        if hit is not None:
+            return {"question": question, "mode": mode, "answer": hit["answer"], "sources": hit["sources"],
+                    "timings": timings, "cached": True}
+
+        started = time.perf_counter()
+        context, chunks = await loop.run_in_executor(app[EXECUTOR], retrieve, question)
+        timings["retrieval"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        async with app[LLM_SLOTS]:
+            answer = await aget_llm_answer(question, context)
+        timings["llm"] = time.perf_counter() - started
+        await loop.run_in_executor(app[EXECUTOR], store_cached, question, mode, embedding, answer, chunks)
+    return {"question": question, "mode": mode, "answer": answer, "sources": chunks, "timings": timings,
+            "cached": False}
+
+
+async def stream_question(app, question, mode):
+    retrieve, _, astream_llm_answer = PIPELINES[mode]
+    loop = asyncio.get_running_loop()
+    async with app[REQUEST_SLOTS]:
+        started = time.perf_counter()
+        embedding, hit = await loop.run_in_executor(app[EXECUTOR], lookup_cached, question, mode)
+        if hit is not None:
+            for event in semantic_cache.hit_events(hit, started):
+                yield event
+            return
+
+        context, chunks = await loop.run_in_executor(app[EXECUTOR], retrieve, question)
+        retrieval_time = time.perf_counter() - started
+        yield {"type": "sources", "sources": chunks, "retrieval_time": retrieval_time}
+
+        tokens = []
+
+        async with app[LLM_SLOTS]:
+            generation_started = time.perf_counter()
+            time_to_first_token = None
+            async for token in astream_llm_answer(question, context):
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - generation_started
+                tokens.append(token)
+                yield {"type": "token", "text": token}
+        await loop.run_in_executor(
+            app[EXECUTOR], store_cached, question, mode, embedding, "".join(tokens), chunks
+        )
+        yield done_event(started, retrieval_time, generation_started, time_to_first_token)
+
+
+async def read_question(request):
+    usage = "Ожидается JSON: {\"question\": ..., \"mode\": \"vector\"|\"graph\"|\"hybrid\"}"
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text=usage)
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=usage)
+    question = body.get("question") or ""
+    mode = body.get("mode", "vector")
+    if not isinstance(question, str) or not isinstance(mode, str):
+        raise web.HTTPBadRequest(text=usage)
+    question = question.strip()
+    if not question:
+        raise web.HTTPBadRequest(text="Пустой вопрос")
+    if mode not in PIPELINES:
+        raise web.HTTPBadRequest(text=f"Неизвестный режим: {mode}")
+    return question, mode
+
+
+# Ответ построчно в NDJSON: sources, затем token..., затем done с таймингами
+async def handle_ask_stream(request):
+    question, mode = await read_question(request)
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+    await response.prepare(request)
+    try:
+        async for event in stream_question(request.app, question, mode):
+            await response.write((json_dumps(event) + "\n").encode("utf-8"))
+    except Exception as e:
+        print("Ошибка при выполнении запроса:", e)
+        await response.write((json_dumps({"type": "error", "error": str(e)}) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def handle_ask(request):
+    question, mode = await read_question(request)
+    try:
+        result = await answer_question(request.app, question, mode)
+    except Exception as e:
+        print("Ошибка при выполнении запроса:", e)
+        raise web.HTTPInternalServerError(text=f"Ошибка при выполнении запроса: {e}")
+    return web.json_response(result, dumps=json_dumps)
+
+
+async def handle_health(request):
+    loop = asyncio.get_running_loop()
+    neo4j = await loop.run_in_executor(request.app[EXECUTOR], get_graph_client.health_check)
+    return web.json_response({
+        "status": "ok",
+        "neo4j": neo4j,
+        "micro_batching": {
+            "query_mean_batch": micro_batcher.get_query_batcher().mean_batch_size(),
+            "rerank_mean_batch": micro_batcher.get_rerank_batcher().mean_batch_size()
+        } if MICRO_BATCHING else None,
+        "rerank": reranking.stats_snapshot(),
+        "startup": warmup.report(),
+        "semantic_cache": semantic_cache.get_cache().stats() if semantic_cache.get_cache() else None
+    })
+
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def on_startup(app):
+    micro_batcher.enable(MICRO_BATCHING)
+    app[EXECUTOR] = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS)
+    app[REQUEST_SLOTS] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    app[LLM_SLOTS] = asyncio.Semaphore(LLM_CONCURRENCY)
+    # Сервис принимает запросы сразу, модели догружаются в фоне;
+    # первый запрос до окончания прогрева дождётся загрузки сам
+    if warmup.WARMUP:
+        warmup.warm_up()
+
+
+async def on_cleanup(app):
+    app[EXECUTOR].shutdown(wait=True)
+    get_answer_hybrid.executor.shutdown()
+    QdrantClientSingleton.close()
+    GraphClientSingleton.close()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_post("/ask", handle_ask)
+    app.router.add_post("/ask/stream", handle_ask_stream)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    web.run_app(create_app(), host=HOST, port=PORT)
@@ -0,0 +1,57 @@
+import time
+import metrics
+
+
+# Потоковый режим: источники отдаются сразу после поиска, ответ — по токенам.
+# Время до первого токена считается отдельно от полного времени генерации.
+def stream_answer(question, retrieve, stream_llm_answer):
+    started = time.perf_counter()
+    context, chunks = retrieve(question)
+    retrieval_time = time.perf_counter() - started
+    yield {"type": "sources", "sources": chunks, "retrieval_time": retrieval_time}
+
+    generation_started = time.perf_counter()
+    time_to_first_token = None
+    for token in stream_llm_answer(question, context):
+        if time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - generation_started
+        yield {"type": "token", "text": token}
+
+    yield done_event(started, retrieval_time, generation_started, time_to_first_token)
+
+
+# Ответ из семантического кэша не генерируется: время до первого токена и
+# генерации не пишутся, полное время — с меткой cached="1"
+def done_event(started, retrieval_time, generation_started, time_to_first_token, cached=False):
+    finished = time.perf_counter()
+    if cached:
+        metrics.observe("rag_stage_seconds", finished - started, stage="answer_total", cached="1")
+    else:
+        if time_to_first_token is not None:
+            metrics.observe("rag_stage_seconds", time_to_first_token, stage="time_to_first_token")
+        metrics.observe("rag_stage_seconds", finished - generation_started, stage="generation")
+        metrics.observe("rag_stage_seconds", finished - started, stage="answer_total")
+    return {
+        "type": "done",
+        "retrieval_time": retrieval_time,
+        "time_to_first_token": time_to_first_token,
+        "generation_time": finished - generation_started,
+        "total_time": finished - started
+    }
+
+
+def print_streamed_answer(events, format_sources):
+    for event in events:
+        if event["type"] == "sources":
+            print(format_sources(event["sources"]))
+            print("Ответ:")
+        elif event["type"] == "token":
+            print(event["text"], end="", flush=True)
+        else:
+            ttft = event["time_to_first_token"]
+            print(
+                f"\n\n[поиск: {event['retrieval_time']:.2f} с, "
+                f"первый токен: {f'{ttft:.2f} с' if ttft is not None else '—'}, "
+                f"генерация: {event['generation_time']:.2f} с, "
+                f"всего: {event['total_time']:.2f} с]"
+            )
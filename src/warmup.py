@@ -0,0 +1,74 @@
+import logging
+import os
+import threading
+import time
+from get_model import Model
+from get_reranker import Reranker
+from get_qdrant_client import QdrantClientSingleton
+
+# Загружать модели в фоне сразу после старта, пока пользователь вводит
+# первый вопрос или сервис уже принимает соединения
+WARMUP = os.getenv("WARMUP", "1") == "1"
+
+logger = logging.getLogger(__name__)
+started = time.perf_counter()
+
+COMPONENTS = {
+    "qdrant": QdrantClientSingleton,
+    "embedder": Model,
+    "reranker": Reranker,
+}
+
+_thread = None
+
+
+def _warm(components):
+    warm_started = time.perf_counter()
+    for name in components:
+        try:
+            COMPONENTS[name].get_instance()
+            if name == "embedder":
+                Model.get_cache()
+        except Exception as e:
+            logger.error("Не удалось загрузить %s: %s", name, e)
+    finished = time.perf_counter()
+    logger.info("Прогрев завершён за %.1f с, готов к вопросам через %.1f с после запуска (%s)",
+                finished - warm_started, finished - started, format_report())
+
+
+def warm_up(components=tuple(COMPONENTS), background=True):
+    global _thread
+    if not background:
+        _warm(components)
+        return None
+    if _thread is None:
+        _thread = threading.Thread(target=_warm, args=(components,), name="warm-up", daemon=True)
+        _thread.start()
+    return _thread
+
+
+def is_ready():
+    return all(cls.is_loaded() for cls in COMPONENTS.values())
+
+
+# Время с импорта модуля и время загрузки каждого компонента (None — ещё не загружен)
+def report():
+    return {
+        "uptime": time.perf_counter() - started,
+        "ready": is_ready(),
+        **{name: cls.load_seconds for name, cls in COMPONENTS.items()}
+    }
+
+
+# Приглашение к вводу появляется сразу, модели догружаются в фоне;
+# когда всё готово, сообщает лог прогрева
+def format_prompt_ready():
+    return (f"Приглашение к вводу через {time.perf_counter() - started:.1f} с после запуска"
+            + (", модели загружаются в фоне" if _thread is not None and _thread.is_alive() else ""))
+
+
+def format_report():
+    return ", ".join(
+        f"{name}: {cls.load_seconds:.1f} с" if cls.load_seconds is not None else f"{name}: не загружен"
+        for name, cls in COMPONENTS.items()
+    )